@@ -0,0 +1,271 @@
+""" Create a compact binary pickler for GameTools classes, using the same json_encode /
+    json_decode methods as the JSON pickler. Repeated strings, dictionary key sets and
+    objects are written once and referred back to by index afterwards. Objects repeat
+    when the same object is written again, or for value objects (json_value_object)
+    when an equal object is written again. """
+import struct
+from numbers import Integral, Real
+from typing import IO
+from GameSystem.json_pickler import JSONEncodable, find_class
+
+# file header: magic bytes and format version
+MAGIC = b"GTBP\x01"
+
+# one byte tags for each kind of value
+NONE, TRUE, FALSE, INT, FLOAT = b"N", b"T", b"F", b"I", b"D"
+STR, STR_REF, LIST, DICT = b"S", b"s", b"L", b"M"
+SHAPE, SHAPE_REF, OBJECT, OBJECT_REF = b"K", b"k", b"O", b"o"
+
+
+class BinaryPicklerException(Exception):
+    """ Exception raised for data that cannot be encoded or decoded. """
+    def __init__(self, msg: str = None):
+        """ Exception raised for data that cannot be encoded or decoded. """
+        super().__init__(msg)
+        self.msg = msg
+
+
+class BinaryEncoder:
+    """ Encode JSONEncodable objects (and JSON-like values) into bytes. """
+    def __init__(self):
+        """ Create an encoder with empty back-reference tables. """
+        self.out = bytearray()
+        self.strings = {}
+        self.shapes = {}
+        self.objects = {}
+        # id(obj) -> (obj, identity of the object), objects are kept alive for one encode.
+        self._identities = {}
+
+    def encode(self, obj) -> bytes:
+        """ Encode obj, returning the bytes including the file header. """
+        self.out = bytearray(MAGIC)
+        self._encode_value(obj)
+        return bytes(self.out)
+
+    def _varint(self, number: int):
+        """ Write a non-negative integer, 7 bits per byte. """
+        while number >= 0x80:
+            self.out.append((number & 0x7f) | 0x80)
+            number >>= 7
+        self.out.append(number)
+
+    def _encode_value(self, value):
+        """ Write a single value of any supported type. """
+        value_type = type(value)
+        if value_type == str:
+            self._encode_str(value)
+        elif value_type == int:
+            self.out += INT
+            self._varint(2 * value if value >= 0 else -2 * value - 1)
+        elif value is None:
+            self.out += NONE
+        elif value is True:
+            self.out += TRUE
+        elif value is False:
+            self.out += FALSE
+        elif isinstance(value, Integral):
+            # zigzag, so small negative numbers stay small
+            value = int(value)
+            self.out += INT
+            self._varint(2 * value if value >= 0 else -2 * value - 1)
+        elif isinstance(value, Real):
+            self.out += FLOAT + struct.pack("<d", float(value))
+        elif isinstance(value, str):
+            self._encode_str(value)
+        elif isinstance(value, (list, tuple)):
+            self.out += LIST
+            self._varint(len(value))
+            for element in value:
+                self._encode_value(element)
+        elif isinstance(value, dict):
+            self._encode_dict(value)
+        elif isinstance(value, JSONEncodable):
+            self._encode_object(value)
+        else:
+            raise BinaryPicklerException(f"Cannot encode {type(value).__name__}")
+
+    def _encode_str(self, value: str):
+        """ Write a string, or a reference to the same string written before. """
+        if value in self.strings:
+            self.out += STR_REF
+            self._varint(self.strings[value])
+        else:
+            encoded = value.encode("utf-8")
+            self.out += STR
+            self._varint(len(encoded))
+            self.out += encoded
+            self.strings[value] = len(self.strings)
+
+    def _encode_dict(self, value: dict):
+        """ Write a dictionary as its key set (or a reference to it) followed by its values. """
+        self.out += DICT
+        shape = tuple(value.keys())
+        if shape in self.shapes:
+            self.out += SHAPE_REF
+            self._varint(self.shapes[shape])
+        else:
+            self.out += SHAPE
+            self._varint(len(shape))
+            for key in shape:
+                self._encode_value(key)
+            self.shapes[shape] = len(self.shapes)
+        for element in value.values():
+            self._encode_value(element)
+
+    def _encode_object(self, obj: JSONEncodable):
+        """ Write an object as its class name and encoding, or as a reference to an
+            equal object written before. """
+        identity = self._identity(obj)
+        if identity in self.objects:
+            self.out += OBJECT_REF
+            self._varint(self.objects[identity])
+            return
+
+        self.out += OBJECT
+        self._encode_str(obj.__class__.__name__)
+        self._encode_dict(obj.json_encode())
+        self.objects[identity] = len(self.objects)
+
+    def _identity(self, value):
+        """ Hashable identity of an encoded value, equal for equal encodings. """
+        value_type = type(value)
+        if value_type == str or value is None:
+            return value
+        if value_type == int:
+            return "I", value
+        if isinstance(value, dict):
+            return "M", tuple((k, self._identity(v)) for k, v in value.items())
+        if isinstance(value, (list, tuple)):
+            return "L", tuple(self._identity(v) for v in value)
+        if isinstance(value, JSONEncodable):
+            if id(value) not in self._identities:
+                # value objects are repeated when equal, other objects when the same object.
+                if value.json_value_object:
+                    identity = (value.__class__.__name__, self._identity(value.json_encode()))
+                else:
+                    identity = ("@", id(value))
+                self._identities[id(value)] = (value, identity)
+            return self._identities[id(value)][1]
+        # tagged, so that True, 1 and 1.0 (which are equal and hash equally) differ
+        if isinstance(value, bool):
+            return "B", value
+        if isinstance(value, Integral):
+            return "I", int(value)
+        if isinstance(value, Real):
+            return "D", float(value)
+        return value
+
+
+class BinaryDecoder:
+    """ Decode bytes written by BinaryEncoder back into objects. """
+    def __init__(self, data: bytes):
+        """ Create a decoder over the data. """
+        self.data = memoryview(data)
+        self.pos = 0
+        self.strings = []
+        self.shapes = []
+        # decoded objects, by back-reference index
+        self.objects = []
+
+    def decode(self):
+        """ Decode the value stored in the data. """
+        if bytes(self.data[:len(MAGIC)]) != MAGIC:
+            raise BinaryPicklerException("Not a GameTools binary pickle")
+        self.pos = len(MAGIC)
+        return self._decode_value()
+
+    def _varint(self) -> int:
+        """ Read a non-negative integer, 7 bits per byte. """
+        number, shift = 0, 0
+        while True:
+            byte = self.data[self.pos]
+            self.pos += 1
+            number |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return number
+            shift += 7
+
+    def _tag(self) -> bytes:
+        """ Read a tag byte. """
+        tag = bytes(self.data[self.pos:self.pos + 1])
+        self.pos += 1
+        return tag
+
+    def _decode_value(self, tag: bytes = None):
+        """ Read a single value. """
+        if tag is None:
+            tag = self._tag()
+        if tag == NONE:
+            return None
+        if tag == TRUE:
+            return True
+        if tag == FALSE:
+            return False
+        if tag == INT:
+            number = self._varint()
+            return number >> 1 if number & 1 == 0 else -((number + 1) >> 1)
+        if tag == FLOAT:
+            self.pos += 8
+            return struct.unpack("<d", self.data[self.pos - 8:self.pos])[0]
+        if tag == STR:
+            length = self._varint()
+            self.pos += length
+            self.strings.append(str(self.data[self.pos - length:self.pos], "utf-8"))
+            return self.strings[-1]
+        if tag == STR_REF:
+            return self.strings[self._varint()]
+        if tag == LIST:
+            return [self._decode_value() for _ in range(self._varint())]
+        if tag == DICT:
+            return self._decode_dict()
+        if tag == OBJECT:
+            class_name = self._decode_value()
+            self._tag()
+            body = self._decode_dict()
+            self.objects.append(self._make_object(class_name, body))
+            return self.objects[-1]
+        if tag == OBJECT_REF:
+            # value objects are referenced when equal, so they are immutable and can be
+            # shared; other objects are only referenced when they were the same object.
+            return self.objects[self._varint()]
+        raise BinaryPicklerException(f"Unknown tag {tag} at byte {self.pos - 1}")
+
+    def _decode_dict(self) -> dict:
+        """ Read a dictionary's key set and values. """
+        tag = self._tag()
+        if tag == SHAPE:
+            shape = [self._decode_value() for _ in range(self._varint())]
+            self.shapes.append(shape)
+        else:
+            shape = self.shapes[self._varint()]
+        return {key: self._decode_value() for key in shape}
+
+    @staticmethod
+    def _make_object(class_name: str, body: dict):
+        """ Decode an object from its encoding, as the JSON decoder would. """
+        obj_json = dict(body)
+        obj_json.update({"__class_name__": class_name, "JSONEncodable": True})
+        cls = find_class(class_name)
+        if cls is None:
+            return obj_json
+        return cls.json_decode(obj_json)
+
+
+def dumps(obj) -> bytes:
+    """ Encode obj into bytes. """
+    return BinaryEncoder().encode(obj)
+
+
+def loads(data: bytes):
+    """ Decode bytes written by dumps. """
+    return BinaryDecoder(data).decode()
+
+
+def dump(obj, fp: IO[bytes]):
+    """ Write obj to a binary file. """
+    fp.write(dumps(obj))
+
+
+def load(fp: IO[bytes]):
+    """ Read an object written by dump from a binary file. """
+    return loads(fp.read())
@@ -760,14 +760,14 @@ class ScrollingMapIO(MapIO):
             y_window += 1
             oy_window += 1
 
-        np_map = np.array(self.main_map.map, dtype=np.unicode)
-
-        np_map = np_map[y_window:oy_window, x_window:ox_window]
+        # load the area around the player, for maps not held in memory all at once
+        self.main_map.prefetch(self.x_loc, self.y_loc, max(w_window, h_window))
+        lines = self.main_map.region_to_strings(x_window, y_window, w_window, h_window)
 
         self.render.erase()
 
-        for line in range(len(np_map)):
-            self.render.addstr(line, 0, self.main_map.array_to_string(np_map[line]))
+        for line in range(len(lines)):
+            self.render.addstr(line, 0, lines[line])
 
         self.render.addstr(self.y_loc - y_window, (self.x_loc - x_window) * 2, self.char)
         self.render.refresh()
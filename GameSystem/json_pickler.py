@@ -2,12 +2,29 @@
 import os
 import json
 import importlib
-import inspect
-import sys
+import tempfile
+from typing import IO, Iterable
 
 
 class JSONEncodable:
     """ If a class inherits from JSONEncodable, then they can be JSON serialized. """
+    # allow subclasses to use __slots__
+    __slots__ = ()
+
+    # class name -> class of every JSONEncodable subclass, filled as they are defined.
+    _classes = {}
+
+    # name of a list field of json_encode() that dump writes one element at a time.
+    json_stream_field = None
+
+    # whether equal objects of this class can be shared, true for immutable value objects.
+    json_value_object = False
+
+    def __init_subclass__(cls, **kwargs):
+        """ Register the subclass by name, so the decoder can find it. """
+        super().__init_subclass__(**kwargs)
+        JSONEncodable._classes[cls.__name__] = cls
+
     def json_encode(self) -> dict:
         """ Encode object into JSON serializable dictionary. """
         return {}
@@ -17,16 +34,72 @@ class JSONEncodable:
         """ Decode JSON serializable dictionary into object. """
         pass
 
+    def json_is_dirty(self) -> bool:
+        """ Whether the object changed since json_mark_clean was last called. """
+        return True
+
+    def json_mark_clean(self):
+        """ Mark the current state as saved (a checkpoint). """
+        pass
+
+    def json_encode_delta(self):
+        """ Encode the changes since the last checkpoint as a JSON serializable dictionary,
+            or return the object itself if it has to be saved in full. """
+        return self
+
+    def json_apply_delta(self, delta: dict):
+        """ Apply changes encoded by json_encode_delta, returning the updated object.
+            Without delta support, the delta is a full encoding which replaces the object. """
+        return self.json_decode(dict(delta))
+
+
+def _import_project_modules():
+    """ Import every module of every package in the project (the folder containing
+        this package), so that their JSONEncodable classes are registered. """
+    working_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+    def add_module_path(sd):
+        """ Provided sd is a folder within the project directory, and that folder is
+            a Python3+ module, format the filename of the __init__.py file. """
+        return working_dir + sd + os.sep + "__init__.py"
+
+    # get all folders which constitute a python module
+    folders = [
+        subdir for subdir in os.listdir(working_dir)
+        if os.path.exists(add_module_path(subdir))
+    ]
+
+    for folder in sorted(folders):
+        for file in sorted(os.listdir(working_dir + folder)):
+            if (file.endswith(".py") and not file.endswith("__init__.py")
+                    and not file.startswith("test_")):
+                try:
+                    importlib.import_module(folder + "." + file[:-3])
+                except ImportError:
+                    # modules with dependencies that are not installed can't define
+                    # anything we are able to decode anyway.
+                    pass
+
+
+def find_class(class_name: str):
+    """ Return the JSONEncodable class with the given name, or None. Classes are registered
+        when defined, and if the class has not been imported yet then the project's modules
+        are imported once to find it. """
+    global _project_imported
+    if class_name not in JSONEncodable._classes and not _project_imported:
+        _project_imported = True
+        _import_project_modules()
+    return JSONEncodable._classes.get(class_name, None)
+
+
+# whether _import_project_modules has been run
+_project_imported = False
+
 
 class JSONEncoder(json.JSONEncoder):
     """ JSONEncoder with support for GameTools defined classes. """
     def default(self, it):
-        super_classes = it.__class__.__mro__
-        super_classes = [
-            s.__name__ for s in super_classes
-        ]
-        if "JSONEncodable" in super_classes:
-            it: JSONEncodable
+        if isinstance(it, JSONEncodable):
             json_encoding = {"__class_name__": it.__class__.__name__, "JSONEncodable": True}
             json_encoding.update(it.json_encode())
 
@@ -37,55 +110,231 @@ class JSONEncoder(json.JSONEncoder):
 
 class JSONDecoder(json.JSONDecoder):
     def __init__(self, *args, **kwargs):
-        json.JSONDecoder.__init__(self, object_hook=JSONDecoder.object_hook, *args, **kwargs)
+        json.JSONDecoder.__init__(self, object_hook=self._interning_hook, *args, **kwargs)
+        # encoding -> (object, encoded dictionary) of the value objects decoded by this
+        # decoder, so that equal value objects are decoded as the same object.
+        self._interned = {}
+
+    def _interning_hook(self, dct):
+        """ Like object_hook, but equal value objects (json_value_object) are decoded once. """
+        if "JSONEncodable" not in dct.keys():
+            return dct
+        cls_obj = find_class(dct['__class_name__'])
+        if cls_obj is None or not cls_obj.json_value_object:
+            return JSONDecoder.object_hook(dct)
+
+        key = _freeze(dct)
+        if key not in self._interned:
+            # the dictionary keeps any objects in the key alive, so their ids stay unique
+            self._interned[key] = (cls_obj.json_decode(dct), dct)
+        return self._interned[key][0]
 
     @staticmethod
     def object_hook(dct):
         """ Convert dictionary from JSON decode into object of type defined in GameTools. """
         if "JSONEncodable" in dct.keys():
-            class_name = dct['__class_name__']
+            cls_obj = find_class(dct['__class_name__'])
+            if cls_obj is not None:
+                return cls_obj.json_decode(dct)
+            return dct
+        else:
+            return dct
 
-            working_dir = os.sep.join(os.getcwd().split(os.sep)[:-1]) + os.sep
 
-            def add_module_path(sd):
-                """ Provided sd is a folder within the current working directory, and that folder is
-                    a Python3+ module, format the filename of the __init__.py file. """
-                return working_dir + sd + os.sep + "__init__.py"
+def _freeze(value):
+    """ Hashable form of a decoded JSON value. Decoded objects are compared by identity,
+        which for value objects is equality, as they are interned as they are decoded. """
+    if isinstance(value, dict):
+        return tuple((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return ("<list>",) + tuple(_freeze(v) for v in value)
+    if isinstance(value, JSONEncodable):
+        return "<object>", id(value)
+    if isinstance(value, bool):
+        # True == 1 and hash(True) == hash(1), keep them apart
+        return "<bool>", value
+    return value
 
-            # get all folders which constitute a python module
-            folders = [
-                subdir for subdir in os.listdir(working_dir)
-                if os.path.exists(add_module_path(subdir))
-            ]
 
-            # find all python files in those modules that are of the form
-            # test_<class_name>.py and add to a list of names
-            list_of_names = []
-            for folder in folders:
-                for file in os.listdir(working_dir + folder):
-                    if not file.endswith("__init__.py") and file.endswith(".py"):
-                        file_path = folder + os.sep + file
-                        module_path = folder + "." + file[:-3]
+def dump(obj, fp: IO[str]):
+    """ Write obj to a text file as one or more lines of JSON. Objects with a
+        json_stream_field are written as a header line, then one record per element
+        of that field, then an end line, so no more than one element is encoded at once.
+        Fields holding such objects (at any depth, like a player's inventory) are written
+        the same way, as nested records after the header line. """
+    _dump_record(obj, fp, JSONEncoder())
 
-                        list_of_names.append(module_path)
-                        importlib.import_module(module_path, file_path)
 
-            list_of_names.sort()
+def dump_many(objs: Iterable, fp: IO[str]):
+    """ Write each object to a text file as a separate record, see dump. """
+    encoder = JSONEncoder()
+    for obj in objs:
+        _dump_record(obj, fp, encoder)
 
-            for module in list_of_names:
-                current_module = sys.modules[module]
 
-                class_members = inspect.getmembers(current_module, inspect.isclass)
-                class_members = [m for m in class_members if m[1].__module__ == module]
+def _is_streamed(value) -> bool:
+    """ Whether dump writes the value as a header, nested records and elements rather than
+        as a single line: objects with a json_stream_field, or with a field holding one.
+        Value objects are always written as a single line. """
+    if not isinstance(value, JSONEncodable) or value.json_value_object:
+        return False
+    return (value.json_stream_field is not None or
+            any(_is_streamed(v) for v in value.json_encode().values()))
 
-                for klass in class_members:
-                    name, cls_obj = klass
 
-                    if name == class_name:
-                        return cls_obj.json_decode(dct)
-            return dct
-        else:
-            return dct
+def _write_line(value, fp: IO[str], encoder: JSONEncoder):
+    """ Write a value as a single line of JSON. """
+    for chunk in encoder.iterencode(value):
+        fp.write(chunk)
+    fp.write("\n")
+
+
+def _dump_record(obj, fp: IO[str], encoder: JSONEncoder):
+    """ Write a single record (and any nested records and streamed elements) to the file. """
+    if not isinstance(obj, JSONEncodable) or obj.json_value_object:
+        _write_line(obj, fp, encoder)
+        return
+
+    fields = dict(obj.json_encode())
+    field = obj.json_stream_field
+    nested = [name for name, value in fields.items() if name != field and _is_streamed(value)]
+    if field is None and len(nested) == 0:
+        _write_line({"__class_name__": obj.__class__.__name__, "JSONEncodable": True,
+                     **fields}, fp, encoder)
+        return
+
+    elements = fields.pop(field) if field is not None else []
+    nested_values = [fields.pop(name) for name in nested]
+
+    _write_line({"__stream__": obj.__class__.__name__, "field": field, "fields": fields,
+                 "nested": nested}, fp, encoder)
+    for value in nested_values:
+        _dump_record(value, fp, encoder)
+    for element in elements:
+        _dump_record(element, fp, encoder)
+    _write_line({"__end__": field}, fp, encoder)
+
+
+def load(fp: IO[str], decoder: JSONDecoder = None):
+    """ Read the next record written by dump from a text file. Only one line is
+        held in memory at a time. Raises EOFError at the end of the file.
+        Records read with the same decoder share equal value objects. """
+    if decoder is None:
+        decoder = JSONDecoder()
+    line = fp.readline()
+    if line == "":
+        raise EOFError("No more records to load")
+    return _load_record(decoder.decode(line), fp, decoder)
+
+
+def iter_load(fp: IO[str]):
+    """ Iterate over all records written by dump / dump_many to a text file. """
+    decoder = JSONDecoder()
+    for line in iter(fp.readline, ""):
+        yield _load_record(decoder.decode(line), fp, decoder)
+
+
+def _load_record(record, fp: IO[str], decoder: JSONDecoder):
+    """ Finish decoding a record, reading its nested records and streamed elements
+        if it has any. """
+    if type(record) != dict or "__stream__" not in record:
+        return record
+
+    fields = record["fields"]
+    for name in record.get("nested", []):
+        line = fp.readline()
+        if line == "":
+            raise EOFError(f"File ended while loading {record['__stream__']}")
+        fields[name] = _load_record(decoder.decode(line), fp, decoder)
+
+    elements = []
+    for line in iter(fp.readline, ""):
+        element = decoder.decode(line)
+        if (type(element) == dict and element.keys() == {"__end__"} and
+                element["__end__"] == record["field"]):
+            break
+        elements.append(_load_record(element, fp, decoder))
+    else:
+        raise EOFError(f"File ended while loading {record['__stream__']}")
+
+    if record["field"] is not None:
+        fields[record["field"]] = elements
+    fields.update({"__class_name__": record["__stream__"], "JSONEncodable": True})
+    return decoder.object_hook(fields)
+
+
+def apply_delta(obj: JSONEncodable, delta):
+    """ Apply a delta from json_encode_delta to obj, returning the updated object.
+        A delta that is an object replaces obj, as does the full encoding a class
+        without delta support is given (see JSONEncodable.json_apply_delta). """
+    if isinstance(delta, JSONEncodable):
+        return delta
+    return obj.json_apply_delta(delta)
+
+
+class DeltaLog:
+    """ Append-only save file for a single object. The file starts with a full snapshot
+        (written by dump) followed by one line per checkpoint holding only the changes
+        made since the previous checkpoint. """
+    def __init__(self, path: str, max_deltas: int = None):
+        """ Create a log at path. If max_deltas is not None, the log is compacted
+            once it holds more than max_deltas deltas. """
+        self.path = path
+        self.max_deltas = max_deltas
+        # number of deltas after the snapshot, None until the file is read or written.
+        self.num_deltas = None
+
+    def checkpoint(self, obj: JSONEncodable):
+        """ Save the changes to obj since the last checkpoint. Unless the log was read with
+            load, the first checkpoint (like one where obj has to be saved in full) writes
+            a snapshot instead. """
+        if self.num_deltas is None:
+            self.compact(obj)
+            return
+        if not obj.json_is_dirty():
+            return
+
+        delta = obj.json_encode_delta()
+        if delta is obj or (self.max_deltas is not None and self.num_deltas >= self.max_deltas):
+            self.compact(obj)
+            return
+
+        with open(self.path, 'a') as fp:
+            fp.write(json.dumps({"__delta__": obj.__class__.__name__, "delta": delta},
+                                cls=JSONEncoder) + "\n")
+        self.num_deltas += 1
+        obj.json_mark_clean()
+
+    def load(self):
+        """ Read the snapshot and apply every delta after it, returning the object. """
+        with open(self.path) as fp:
+            decoder = JSONDecoder()
+            obj = load(fp, decoder)
+            self.num_deltas = 0
+            for line in iter(fp.readline, ""):
+                obj = apply_delta(obj, decoder.decode(line)["delta"])
+                self.num_deltas += 1
+        obj.json_mark_clean()
+        return obj
+
+    def compact(self, obj: JSONEncodable = None):
+        """ Replace the log with a single snapshot of obj (by default, the object the log
+            currently holds). The snapshot is written to a temporary file first, so the
+            log is never left half written. """
+        if obj is None:
+            obj = self.load()
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)),
+                                        suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                dump(obj, fp)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.num_deltas = 0
+        obj.json_mark_clean()
 
 
 if __name__ == '__main__':
@@ -117,4 +366,4 @@ if __name__ == '__main__':
 
     #/print("Freeze thawed correctly:", pickled_obj == thawed)
 
-    #print(thawed)
\ No newline at end of file
+    #print(thawed)
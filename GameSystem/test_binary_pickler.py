@@ -0,0 +1,63 @@
+from unittest import TestCase
+# need GameSystem.binary_pickler since suite outside game system folder
+import GameSystem.binary_pickler as bp
+import GameSystem.json_pickler as jp
+from GameSystem.test_json_pickler import example_inventory
+from InventorySystem.inventory import Item, ItemCategory, Wallet, CurrencySystem, PriceRegistry
+from collections import OrderedDict
+import json
+
+
+class BinaryPicklerTest(TestCase):
+    """ Binary pickler module test cases. """
+    def test_round_trip(self):
+        """ Test that objects and plain values decode equal to what was encoded. """
+        inv = example_inventory()
+        thawed = bp.loads(bp.dumps(inv))
+        self.assertEqual(thawed, inv)
+        self.assertEqual(str(thawed), str(inv))
+
+        values = [0, -1, 2 ** 80, -2 ** 70, 1.5, True, False, None, "", "█", [1, [2]],
+                  {"a": 1, "b": {"c": "d"}}, {"a": 2, "b": {"c": "e"}}]
+        self.assertEqual(bp.loads(bp.dumps(values)), values)
+
+        registry = PriceRegistry(registry={"Foo": 2, "Bar": 3})
+        self.assertEqual(bp.loads(bp.dumps(registry)), registry)
+
+        curr_sys = CurrencySystem(OrderedDict({"Gold": 1, "Silver": 7}))
+        wallet = Wallet(curr_sys=curr_sys, amount=19)
+        self.assertEqual(bp.loads(bp.dumps(wallet)).wallet, wallet.wallet)
+
+    def test_deduplication(self):
+        """ Test that repeated objects are written once and value objects are shared. """
+        food = ItemCategory("Food")
+        items = [Item("Apple " + str(i % 10), quantity=i % 3 + 1, category=ItemCategory("Food"),
+                      price=i % 10) for i in range(300)]
+
+        encoded = bp.dumps(items)
+        self.assertTrue(len(encoded) * 4 < len(json.dumps(items, cls=jp.JSONEncoder)))
+        self.assertEqual(encoded.count(b"Food"), 1)
+
+        thawed = bp.loads(encoded)
+        self.assertEqual([(it, it.quantity) for it in thawed], [(it, it.quantity) for it in items])
+        self.assertEqual(thawed[0].category, food)
+
+        categories = bp.loads(bp.dumps([ItemCategory("Food"), ItemCategory("Food")]))
+        self.assertTrue(categories[0] is categories[1])
+
+        # equal items which are not value objects are still separate objects
+        self.assertEqual(thawed[0], thawed[30])
+        self.assertFalse(thawed[0] is thawed[30])
+
+        # an object appearing twice decodes to one object, not two sharing their fields
+        inv = example_inventory()
+        pair = bp.loads(bp.dumps([inv, inv]))
+        self.assertTrue(pair[0] is pair[1])
+        self.assertEqual(pair[0], inv)
+
+    def test_invalid(self):
+        """ Test that data which is not a binary pickle is rejected. """
+        with self.assertRaises(bp.BinaryPicklerException):
+            bp.loads(b"{}")
+        with self.assertRaises(bp.BinaryPicklerException):
+            bp.dumps(object())
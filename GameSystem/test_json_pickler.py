@@ -0,0 +1,153 @@
+from unittest import TestCase
+# need GameSystem.json_pickler since suite outside game system folder
+import GameSystem.json_pickler as jp
+from InventorySystem.inventory import Item, ItemCategory, ItemFilter, InventorySystem, Inventory
+import json
+import os
+import tempfile
+
+
+def example_inventory():
+    """ Create an inventory with a few pages and items to pickle. """
+    shield_cat = ItemCategory(name="Shields")
+    weapons_cat = ItemCategory(name="Weapons")
+    food_cat = ItemCategory(name="Food")
+
+    filters = ItemFilter.generate_filters([[shield_cat], [weapons_cat], [food_cat]])
+
+    inv = Inventory(pages=[InventorySystem(item_filter=f) for f in filters])
+
+    inv += Item("Bow", quantity=3, stack_limit=1, category=weapons_cat)
+    inv += Item("Sword", quantity=2, stack_limit=1, category=weapons_cat, price=12)
+    inv += Item("Shield", quantity=2, stack_limit=1, category=shield_cat)
+    inv += Item("Apples", quantity=59, category=food_cat, price=1)
+    return inv
+
+
+class JSONPicklerTest(TestCase):
+    """ JSON pickler module test cases. """
+    def test_round_trip(self):
+        """ Test that an inventory is decoded equal to the encoded inventory. """
+        inv = example_inventory()
+        thawed = json.loads(json.dumps(inv, cls=jp.JSONEncoder), cls=jp.JSONDecoder)
+
+        self.assertEqual(thawed, inv)
+        self.assertEqual(str(thawed), str(inv))
+
+    def test_value_objects_interned(self):
+        """ Test that equal value objects are decoded as a single object per load. """
+        inv = example_inventory()
+        inv += [Item("Item " + str(i), category=ItemCategory("Food"), price=i) for i in range(20)]
+        text = json.dumps(inv, cls=jp.JSONEncoder)
+        # otherwise decoded items find the interned item types of the original items
+        del inv
+        thawed = json.loads(text, cls=jp.JSONDecoder)
+
+        items = sum([page.get_slots() for page in thawed.pages], start=[])
+        self.assertEqual(len({id(it.category) for it in items if it.category is not None}), 3)
+        self.assertEqual(len({id(it.price.curr_sys) for it in items
+                              if it.price is not None}), 1)
+        # the food page's filter refers to the same category as the food items
+        food = [it.category for it in items if it.name == "Apples"][0]
+        self.assertTrue(any(c is food for page in thawed.pages
+                            for c in page.item_filter.filter_cats))
+
+        # separate loads do not share objects
+        other = json.loads(text, cls=jp.JSONDecoder)
+        self.assertFalse(other.pages[0].item_filter is thawed.pages[0].item_filter)
+        self.assertEqual(other, thawed)
+
+    def test_class_registry(self):
+        """ Test that classes are found by name regardless of the working directory. """
+        self.assertTrue(jp.find_class("Inventory") is Inventory)
+        self.assertTrue(jp.find_class("Item") is Item)
+        self.assertIsNone(jp.find_class("NotAGameToolsClass"))
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                inv = example_inventory()
+                thawed = json.loads(json.dumps(inv, cls=jp.JSONEncoder), cls=jp.JSONDecoder)
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(thawed, inv)
+
+        unknown = {"__class_name__": "NotAGameToolsClass", "JSONEncodable": True}
+        self.assertEqual(jp.JSONDecoder.object_hook(unknown), unknown)
+
+    def test_stream(self):
+        """ Test streaming inventories to and from a file one record at a time. """
+        inv = example_inventory()
+        other = example_inventory() + Item("Pear", quantity=4)
+
+        with tempfile.TemporaryFile('w+') as fp:
+            jp.dump(inv, fp)
+            jp.dump_many([other, Item("Loose", quantity=2), 5], fp)
+            fp.seek(0)
+
+            lines = fp.readlines()
+            # header, then per page a header, one line per stack and an end line, then an end line
+            inv_lines = 2 + sum([2 + page.num_slots() for page in inv.pages])
+            self.assertEqual(json.loads(lines[inv_lines - 1]), {"__end__": "pages"})
+            self.assertTrue(all(len(line) < 1000 for line in lines))
+            fp.seek(0)
+
+            self.assertEqual(jp.load(fp), inv)
+            rest = list(jp.iter_load(fp))
+            self.assertEqual(rest[0], other)
+            self.assertEqual((rest[1], rest[1].quantity), (Item("Loose"), 2))
+            self.assertEqual(rest[2], 5)
+            with self.assertRaises(EOFError):
+                jp.load(fp)
+
+    def test_delta_log(self):
+        """ Test that checkpoints only write the changed stacks and that compacting
+            the log gives the same inventory. """
+        inv = example_inventory()
+        inv += [Item("Item " + str(i), quantity=2) for i in range(200)]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "inventory.save")
+            log = jp.DeltaLog(path)
+            log.checkpoint(inv)
+            snapshot_size = os.path.getsize(path)
+
+            inv += Item("Apples", quantity=1, category=ItemCategory("Food"), price=1)
+            inv -= Item("Bow", quantity=3, stack_limit=1, category=ItemCategory("Weapons"))
+            log.checkpoint(inv)
+            self.assertLess(os.path.getsize(path) - snapshot_size, snapshot_size // 10)
+
+            loaded = jp.DeltaLog(path).load()
+            self.assertEqual(loaded, inv)
+            self.assertEqual([page.get_slots() for page in loaded.pages],
+                             [page.get_slots() for page in inv.pages])
+
+            log = jp.DeltaLog(path, max_deltas=1)
+            inv = log.load()
+            for i in range(2):
+                inv += Item("Pear", quantity=1)
+                log.checkpoint(inv)
+            # the log already held one delta, so the first checkpoint compacts it
+            self.assertEqual(log.num_deltas, 1)
+            log.compact()
+            self.assertEqual(os.listdir(tmp_dir), ["inventory.save"])
+            self.assertEqual(jp.DeltaLog(path).load(), inv)
+
+            # stacks split unevenly are loaded into the slots they were saved in
+            page = InventorySystem(stack_limit=5, item_filter=ItemFilter(accept_all=True))
+            page = page + Item("apple", quantity=10) - Item("apple", quantity=2)
+            log = jp.DeltaLog(path)
+            log.checkpoint(page)
+            page -= Item("apple")
+            log.checkpoint(page)
+            self.assertEqual([x.quantity for x in page.get_slots()], [2, 5])
+            loaded = jp.DeltaLog(path).load()
+            self.assertEqual([x.quantity for x in loaded.get_slots()], [2, 5])
+            self.assertEqual(loaded.num_items, 7)
+
+        # classes without delta support are replaced by their full encoding
+        category = ItemCategory("Gems", stack_limit=3)
+        replaced = jp.apply_delta(ItemCategory("Rocks"), category.json_encode())
+        self.assertEqual((replaced.name, replaced.stack_limit), ("Gems", 3))
+        self.assertTrue(jp.apply_delta(None, category) is category)
@@ -1,14 +1,21 @@
 from __future__ import annotations
 from ansiwrap import *
-import copy
 from typing import Union, Dict, Any, List, IO
 import warnings
-import random
 import GameSystem.json_pickler as jp
 from collections import OrderedDict
+from collections.abc import MutableMapping
 import math
 from io import TextIOWrapper
+from types import MappingProxyType
+from contextlib import contextmanager
 import json
+import weakref
+import sqlite3
+import os
+import numpy as np
+import bisect
+import heapq
 
 
 class InventoryException(Exception):
@@ -33,36 +40,152 @@ class CurrencyException(Exception):
         self.cause = cause
 
 
+class ItemType:
+    """ Immutable definition of an item (everything but the quantity). Item types are
+        interned, so every stack of the same item shares a single ItemType. """
+    __slots__ = ("name", "stack_limit", "max_slots", "category", "_price", "unit_price",
+                 "unit_weight", "key", "_hash", "_rows", "__weakref__")
+
+    # maximum number of quantities with cached display rows per item type.
+    max_cached_rows = 64
+
+    # interned item types, dropped once no item refers to them.
+    _interned = weakref.WeakValueDictionary()
+
+    def __init__(self, name: str, stack_limit: int = None, max_slots: int = None,
+                 category: ItemCategory = None, price: Wallet = None, unit_weight: int = None):
+        """ Create an item type. Use ItemType.intern to get the shared instance instead. """
+        # wallets can be changed, so the type keeps its own copy and only hands out copies.
+        if isinstance(price, Wallet):
+            price = Wallet(curr_sys=price.curr_sys, amount=price.amount)
+        unit_price = price.unstack() if isinstance(price, Wallet) else price
+        for field, value in [("name", name), ("stack_limit", stack_limit),
+                             ("max_slots", max_slots), ("category", category),
+                             ("_price", price), ("unit_price", unit_price),
+                             ("unit_weight", unit_weight)]:
+            object.__setattr__(self, field, value)
+
+        # identity of the item, equal items have equal keys.
+        object.__setattr__(self, "key", (
+            name, stack_limit, max_slots, category, unit_price, unit_weight))
+        object.__setattr__(self, "_hash", hash(self.key))
+        # quantity -> display fields of a stack of this item, see Item._row.
+        object.__setattr__(self, "_rows", {})
+
+    @property
+    def price(self):
+        """ Price of one item, as a new Wallet (or None), so changing it does not change
+            the item type. See unit_price for the price in the lowest denomination. """
+        if isinstance(self._price, Wallet):
+            return Wallet(curr_sys=self._price.curr_sys, amount=self._price.amount)
+        return self._price
+
+    def __eq__(self, other):
+        """ Item types are equal if their keys are, interned types are compared by identity. """
+        if self is other:
+            return True
+        if type(other) != ItemType:
+            return False
+        return self._hash == other._hash and self.key == other.key
+
+    def __hash__(self):
+        """ Return the precomputed hash of the key. """
+        return self._hash
+
+    def __setattr__(self, key, value):
+        """ Item types are shared between items, so they cannot be changed. """
+        raise AttributeError("ItemType is immutable")
+
+    def __copy__(self):
+        """ Item types are immutable, so copies are the same object. """
+        return self
+
+    def __deepcopy__(self, memo):
+        """ Item types are immutable, so copies are the same object. """
+        return self
+
+    def __reduce__(self):
+        """ Unpickle by interning the same definition. """
+        return ItemType.intern, (self.name, self.stack_limit, self.max_slots,
+                                 self.category, self.price, self.unit_weight)
+
+    @classmethod
+    def intern(cls, name: str, stack_limit: int = None, max_slots: int = None,
+               category: ItemCategory = None, price: Union[Wallet, int] = None,
+               unit_weight: int = None):
+        """ Return the shared item type for the given definition. Integer prices are
+            converted into a Wallet of the default currency system. """
+        if type(price) == int:
+            price_key = (price, (("Gold", 1),))
+        elif isinstance(price, Wallet):
+            price_key = (price.unstack(), tuple(price.curr_sys.relative_denominations.items()))
+        else:
+            price_key = (price, None)
+
+        # the category and currency system are compared by name / value in the item key,
+        # but their limits and denominations still change how the item behaves.
+        category_key = None if category is None else (category, category.stack_limit,
+                                                      category.max_slots)
+
+        intern_key = (name, stack_limit, max_slots, category_key, price_key, unit_weight)
+
+        item_type = cls._interned.get(intern_key, None)
+        if item_type is None:
+            if type(price) == int:
+                price = Wallet(amount=price)
+            item_type = cls(name, stack_limit, max_slots, category, price, unit_weight)
+            cls._interned[intern_key] = item_type
+        return item_type
+
+
+def _item_type_field(field: str):
+    """ Read-only property of an Item that is stored on its shared ItemType. """
+    return property(lambda self: getattr(self.item_type, field),
+                    doc=f"Item {field}, shared by all stacks of this item.")
+
+
 class Item(jp.JSONEncodable):
     """ An item used in an inventory system. """
+    # only the quantity is stored per stack, the rest is the shared item type.
+    __slots__ = ("item_type", "quantity")
+
+    name = _item_type_field("name")
+    stack_limit = _item_type_field("stack_limit")
+    max_slots = _item_type_field("max_slots")
+    category = _item_type_field("category")
+    price = _item_type_field("price")
+    unit_price = _item_type_field("unit_price")
+    unit_weight = _item_type_field("unit_weight")
+    key = _item_type_field("key")
+
     def __init__(self, name: str, **kwargs):
         """ Create an item with a name, and any one of the following keyword arguments. """
         self.quantity = kwargs.get("quantity", 1)
 
-        self.stack_limit = kwargs.get("stack_limit", None)
-        self.max_slots = kwargs.get("max_slots", None)
-
-        self.category = kwargs.get("category", None)
-        self.price = kwargs.get("price", None)
-        if type(self.price) == int:
-            # if provided a number:
-            self.price = Wallet(amount=self.price)
+        unit_weight = kwargs.get("unit_weight", None)
 
-        self.unit_weight = kwargs.get("unit_weight", None)
-
-        if self.unit_weight is not None and self.unit_weight <= 0:
+        if unit_weight is not None and unit_weight <= 0:
             raise InventoryException(self, msg="Item with non-positive weight defined.")
 
-        self.name = " ".join([n.capitalize() for n in name.split(" ")])
+        self.item_type = ItemType.intern(" ".join([n.capitalize() for n in name.split(" ")]),
+                                         stack_limit=kwargs.get("stack_limit", None),
+                                         max_slots=kwargs.get("max_slots", None),
+                                         category=kwargs.get("category", None),
+                                         price=kwargs.get("price", None),
+                                         unit_weight=unit_weight)
 
-        self.kwargs = {}
-        self.kwargs.update({"quantity": self.quantity})
-        self.kwargs.update({"stack_limit": self.stack_limit})
-        self.kwargs.update({"max_slots": self.max_slots})
-        self.kwargs.update({"category": self.category})
-        self.kwargs.update({"price": self.price})
-        self.kwargs.update({"unit_weight": self.unit_weight})
-        self.kwargs.update({"name": self.name})
+    @property
+    def kwargs(self):
+        """ Keyword arguments which recreate this item. """
+        return {
+            "quantity": self.quantity,
+            "stack_limit": self.stack_limit,
+            "max_slots": self.max_slots,
+            "category": self.category,
+            "price": self.price,
+            "unit_weight": self.unit_weight,
+            "name": self.name
+        }
 
     def __str__(self):
         """ Join all provided fields as space separated list of fields."""
@@ -72,15 +195,14 @@ class Item(jp.JSONEncodable):
 
     def __eq__(self, other):
         """ Equal items have the same name, may only differ by quantity. """
-        if other is None:
+        if not isinstance(other, Item):
             return False
 
-        for kwarg in self.kwargs.keys():
-            if kwarg != 'quantity':
-                if self.kwargs[kwarg] != other.kwargs[kwarg]:
-                    return False
+        return self.item_type == other.item_type
 
-        return self.name == other.name
+    def __hash__(self):
+        """ Hash of the item type, since equal items may differ by quantity. """
+        return self.item_type._hash
 
     def __ne__(self, other):
         """ Must be defined, much like rmul. """
@@ -114,14 +236,21 @@ class Item(jp.JSONEncodable):
     def copy(self, **kwargs):
         """ Different from copy.deepcopy / copy.copy. Allows a copy to be made
             while changing certain parameters, keeping all unspecified fields. """
-        kw = self.kwargs.copy()
+        if kwargs.keys() <= {"quantity"}:
+            # same definition, so share the item type
+            it = type(self).__new__(type(self))
+            it.item_type = self.item_type
+            it.quantity = kwargs.get("quantity", self.quantity)
+            return it
+
+        kw = self.kwargs
         kw.update(kwargs)
 
         return Item(**kw)
 
     def add_self_to_registry(self, registry: PriceRegistry):
         """ Add this item to the price registry using the current name and price. """
-        registry.add_to_registry(self.name, self.price.unstack())
+        registry.add_to_registry(self.name, self.unit_price)
 
     def json_encode(self) -> dict:
         """ Encode into JSON. """
@@ -144,23 +273,37 @@ class Item(jp.JSONEncodable):
             return []
 
         # assumes all are formatted the same (fields() should give same length lists)
-        item_strings = [[field.strip() + ("  " if ansilen(field) > 0 else "")
-                         for field in it.fields()] for it in item_list]
+        rows = [it._row() for it in item_list]
 
         # get length of each field in list.
-        feature_lens = [max([ansilen(item_strings[n][i]) for n in range(len(item_strings))])
-                        for i in range(max([len(item_strings[n])
-                                            for n in range(len(item_strings))]))]
+        feature_lens = [max([row[i][1] for row in rows])
+                        for i in range(max([len(row) for row in rows]))]
         # generate padded fields and join together.
-        item_strings = ["".join([it_str[i] + " "*(feature_lens[i] - ansilen(it_str[i]))
-                        for i in range(len(feature_lens))]) for it_str in item_strings]
+        item_strings = ["".join([row[i][0] + " "*(feature_lens[i] - row[i][1])
+                        for i in range(len(feature_lens))]) for row in rows]
 
         return item_strings
 
+    def _row(self):
+        """ Display fields of the stack and their lengths (without ansi codes), formatted
+            once per item type and quantity and cached on the item type. """
+        rows = self.item_type._rows
+        row = rows.get(self.quantity, None)
+        if row is None:
+            row = tuple((field, ansilen(field)) for field in
+                        [field.strip() + ("  " if ansilen(field) > 0 else "")
+                         for field in self.fields()])
+            if len(rows) >= ItemType.max_cached_rows:
+                rows.clear()
+            rows[self.quantity] = row
+        return row
+
 
 class ItemCategory(jp.JSONEncodable):
     """ Category for items. Each item can belong to multiple categories, but it is
         recommended that only one be used. """
+    json_value_object = True
+
     def __init__(self, name: str, **kwargs):
         """ Define a new category. Can include stack limits or max slot capacities. """
         self.name = name
@@ -173,6 +316,8 @@ class ItemCategory(jp.JSONEncodable):
 
     def __eq__(self, other):
         """ Equality of all fields. """
+        if other is self:
+            return True
         if other is None:
             return False
         return self.name == other.name
@@ -196,6 +341,8 @@ class ItemCategory(jp.JSONEncodable):
 
 class ItemFilter(jp.JSONEncodable):
     """ Filter for Inventory Systems. Default filter is a blanket block filter. """
+    json_value_object = True
+
     def __init__(self, filter_cats: Dict[Union[ItemCategory, None, Any], bool] = None,
                  accept_all: bool = False):
         """ None key in filter_cats corresponds to default behaviour. """
@@ -211,6 +358,8 @@ class ItemFilter(jp.JSONEncodable):
         return str({str(k): v for k, v in self.filter_cats.items()})
 
     def __eq__(self, other):
+        if other is self:
+            return True
         if type(other) == ItemFilter:
             return self.filter_cats == other.filter_cats
         else:
@@ -333,6 +482,12 @@ class ItemFilter(jp.JSONEncodable):
 
 class InventorySystem(jp.JSONEncodable):
     """ A flexible inventory system. """
+    # if true, running totals are checked against a full recount after every change.
+    debug_totals = False
+
+    # json_pickler.dump writes one stack at a time.
+    json_stream_field = "_contents"
+
     def __init__(self, **kwargs):
         """ Generate an inventory system (inventory page)
             based on the following keyword arguments. """
@@ -349,6 +504,16 @@ class InventorySystem(jp.JSONEncodable):
         self.kwargs.update({"_contents": self._contents})
         self.kwargs.update({"num_items": 0})
 
+        # item type -> slot indices of stacks of that item, and slots used per category / name.
+        self._index = {}
+        self._cat_slots = {}
+        self._name_slots = {}
+
+        # running totals of the weight, number of items and number of items per category.
+        self._total_weight = 0
+        self._num_items = 0
+        self._cat_counts = {}
+
         # maximum number of items per stack
         self.stack_limit = kwargs.get("stack_limit", None)
         if self.stack_limit is not None:
@@ -371,6 +536,24 @@ class InventorySystem(jp.JSONEncodable):
         self.item_filter = kwargs.get("item_filter", ItemFilter())
         self.kwargs.update({"item_filter": self.item_filter})
 
+        # whether _contents is shared with a copy of this page (copy-on-write).
+        self._shared = False
+
+        # slot indices written since the last checkpoint, and whether the whole
+        # page has to be saved again (see json_encode_delta).
+        self._dirty = set()
+        self._dirty_all = True
+
+        # cached str of the page, None after the slots change.
+        self._render = None
+
+        # sorted lists of stacks by name, value, weight and category, None until first
+        # queried (see _build_sorted). Storage order is never changed by them.
+        self._sorted = None
+        # per slot, the sequence number of the stack in the sorted lists.
+        self._seqs = None
+        self._next_seq = 0
+
         if self.weight_based and self.weight_limit <= 0:
             warnings.warn("Weight based system with non-positive weight limit")
         elif self.weight_based:
@@ -382,20 +565,20 @@ class InventorySystem(jp.JSONEncodable):
 
     def __add__(self, other: Union[Item, list[Item]]):
         """ Add a single item or a list of items to the inventory. """
+        inv_copy = self._cow_copy()
         if type(other) == Item:
-            return copy.deepcopy(self)._add_item(other)
+            return inv_copy._add_item(other)
         else:
-            inv_copy = copy.deepcopy(self)
             for item in other:
                 inv_copy._add_item(item)
             return inv_copy
 
     def __sub__(self, other: Union[Item, list[Item]]):
         """ Remove a single item or a list of items to the inventory. """
+        inv_copy = self._cow_copy()
         if type(other) == Item:
-            return copy.deepcopy(self)._remove_item(other)
+            return inv_copy._remove_item(other)
         else:
-            inv_copy = copy.deepcopy(self)
             for item in other:
                 inv_copy._remove_item(item)
             return inv_copy
@@ -405,9 +588,9 @@ class InventorySystem(jp.JSONEncodable):
             eq_kw = True
             for key in self.kwargs.keys():
                 if key == "_contents":
-                    self.get_contents().sort(key=lambda it: it.name)
-                    other.get_contents().sort(key=lambda it: it.name)
-                    eq_kw = eq_kw if self.get_contents() == other.get_contents() else False
+                    contents = sorted(self.get_contents(), key=lambda it: it.name)
+                    other_contents = sorted(other.get_contents(), key=lambda it: it.name)
+                    eq_kw = eq_kw if contents == other_contents else False
                 else:
                     eq_kw = eq_kw if self.kwargs[key] == other.kwargs.get(key, None) else False
 
@@ -416,11 +599,19 @@ class InventorySystem(jp.JSONEncodable):
             return False
 
     def __str__(self):
+        """ Display inventory as a list of items with their parameters. The result is
+            cached until the page changes. """
+        if self._render is None:
+            self._render = self._render_str()
+        return self._render
+
+    def _render_str(self):
         """ Display inventory as a list of items with their parameters. """
-        self._contents.sort(key=lambda item: item.quantity, reverse=True)
-        self._contents.sort(key=lambda item: item.name)
-        self._contents.sort(key=lambda item: item.name if item.category is None
-                            else item.category.name)
+        # sorted copy, slot order is tracked by the item index and must not change.
+        # by category (name for generalized items), then name, then largest stack first.
+        contents = sorted(self._contents, key=lambda item: (
+            item.name if item.category is None else item.category.name,
+            item.name, -item.quantity))
 
         inv_name = ""
         if self.item_filter is not None:
@@ -438,12 +629,12 @@ class InventorySystem(jp.JSONEncodable):
 
             inv_name = "| " + " & ".join(categories)
 
-        item_lst_str = Item.align(self._contents)
+        item_lst_str = Item.align(contents)
 
         text_ = "Empty Inventory"
 
         width = max(
-            [ansilen(inv_name), (ansilen(text_)+1 if len(self._contents) == 0 else 0)] +
+            [ansilen(inv_name), (ansilen(text_)+1 if len(contents) == 0 else 0)] +
             [ansilen(i) for i in item_lst_str])
 
         l_end = "+-" + "-" * width + "+"
@@ -457,6 +648,200 @@ class InventorySystem(jp.JSONEncodable):
                           "\n".join([p + " " * (len(l_end) - ansilen(p) - 1) + "|"
                                      for p in presentation.split("\n")]), l_end])
 
+    def _cow_copy(self):
+        """ Return a copy of this page that shares its slots with this page until either
+            one of them is written to. Items stored in a page are never mutated in place
+            (pages only hand out copies of them), so the stacks themselves stay shared:
+            the first write copies the slot list and indexes (see _claim) and replaces
+            only the stacks it changes. """
+        # same as copy.copy, without the generic copy protocol overhead
+        inv_copy = object.__new__(self.__class__)
+        inv_copy.__dict__.update(self.__dict__)
+        inv_copy.kwargs = self.kwargs.copy()
+        self._shared = inv_copy._shared = True
+        return inv_copy
+
+    def _claim(self):
+        """ Take ownership of the slot list before writing to it. This copies the slot
+            list, indexes and sorted lists (references only, not the stacks), once per
+            copy of the page. """
+        if self._shared:
+            self._contents = self._contents[::]
+            self.kwargs.update({"_contents": self._contents})
+            # index values are tuples, so a shallow copy of the index is enough.
+            self._index = self._index.copy()
+            self._cat_slots = self._cat_slots.copy()
+            self._name_slots = self._name_slots.copy()
+            self._cat_counts = self._cat_counts.copy()
+            self._dirty = set(self._dirty)
+            if self._sorted is not None:
+                self._sorted = {by: entries[::] for by, entries in self._sorted.items()}
+                self._seqs = self._seqs[::]
+            self._shared = False
+
+    def _count(self, it: Item, sign: int = 1):
+        """ Add (sign=1) or subtract (sign=-1) a stack from the running totals. """
+        self._total_weight += sign * (it.unit_weight or 0) * it.quantity
+        self._num_items += sign * it.quantity
+        self._cat_counts[it.category] = self._cat_counts.get(it.category, 0) + sign * it.quantity
+
+    def _set_slot(self, index: int, it: Item):
+        """ Replace the stack at a slot index with a stack of the same item. """
+        self._count(self._contents[index], -1)
+        self._count(it)
+        if self._sorted is not None:
+            self._unsort_slot(index)
+        self._contents[index] = it
+        if self._sorted is not None:
+            self._sort_slot(index)
+        self._dirty.add(index)
+        self._render = None
+
+    def _append_slot(self, it: Item):
+        """ Add a new stack to the end of the slot list, updating the item index. """
+        key = it.item_type
+        self._index[key] = self._index.get(key, ()) + (len(self._contents),)
+        self._cat_slots[it.category] = self._cat_slots.get(it.category, 0) + 1
+        self._name_slots[it.name] = self._name_slots.get(it.name, 0) + 1
+        self._count(it)
+        self._dirty.add(len(self._contents))
+        self._contents.append(it)
+        if self._sorted is not None:
+            self._seqs.append(None)
+            self._sort_slot(len(self._contents) - 1)
+        self._render = None
+
+    def _drop_slot(self, index: int):
+        """ Remove the stack at a slot index by moving the last stack into its place. """
+        it = self._contents[index]
+        key = it.item_type
+        self._index[key] = tuple(i for i in self._index[key] if i != index)
+        if len(self._index[key]) == 0:
+            self._index.pop(key)
+        self._cat_slots[it.category] -= 1
+        self._name_slots[it.name] -= 1
+        self._count(it, -1)
+        if self._sorted is not None:
+            self._unsort_slot(index)
+
+        last = len(self._contents) - 1
+        if index != last:
+            moved = self._contents[last]
+            self._contents[index] = moved
+            self._index[moved.item_type] = tuple(index if i == last else i
+                                           for i in self._index[moved.item_type])
+            self._dirty.add(index)
+            if self._sorted is not None:
+                self._seqs[index] = self._seqs[last]
+        self._contents.pop()
+        if self._sorted is not None:
+            self._seqs.pop()
+        self._render = None
+
+    def _reset_slots(self):
+        """ Empty the page, returning the stacks it held. """
+        all_contents = self._contents
+        self._contents = []
+        self.kwargs.update({"_contents": self._contents})
+        self._index = {}
+        self._cat_slots = {}
+        self._name_slots = {}
+        self._total_weight = 0
+        self._num_items = 0
+        self._cat_counts = {}
+        self._shared = False
+        self._dirty = set()
+        self._dirty_all = True
+        self._render = None
+        self._sorted = None
+        self._seqs = None
+        return all_contents
+
+    @staticmethod
+    def _sort_entries(it: Item, seq: int):
+        """ Entries of a stack in each sorted list. The sequence number is unique per stack,
+            so entries never compare the stacks themselves. """
+        value = (it.unit_price or 0) * it.quantity
+        category_key = (0, "") if it.category is None else (1, it.category.name)
+        return {
+            "name": (it.name, seq, it),
+            "value": (value, seq, it),
+            "weight": ((it.unit_weight or 0) * it.quantity, seq, it),
+            # within a category, the most valuable stacks first
+            "category": (category_key, -value, seq, it),
+        }
+
+    def _sort_slot(self, index: int):
+        """ Insert the stack at a slot index into the sorted lists. Finding the position is a
+            binary search, but inserting shifts the entries after it, so each write is
+            O(slots), a memmove of references rather than a re-sort. """
+        self._seqs[index] = self._next_seq
+        self._next_seq += 1
+        for by, entry in self._sort_entries(self._contents[index], self._seqs[index]).items():
+            bisect.insort(self._sorted[by], entry)
+
+    def _unsort_slot(self, index: int):
+        """ Remove the stack at a slot index from the sorted lists, O(slots) like _sort_slot. """
+        for by, entry in self._sort_entries(self._contents[index], self._seqs[index]).items():
+            entries = self._sorted[by]
+            del entries[bisect.bisect_left(entries, entry)]
+
+    def _build_sorted(self):
+        """ Build the sorted lists, which are kept up to date from then on. Building them
+            sorts each list once (O(slots log slots)); each slot write after that costs
+            O(slots) per list (see _sort_slot), and queries read them without sorting. """
+        if self._sorted is None:
+            self._seqs = list(range(len(self._contents)))
+            self._next_seq = len(self._contents)
+            self._sorted = {by: [] for by in ["name", "value", "weight", "category"]}
+            for index in range(len(self._contents)):
+                for by, entry in self._sort_entries(self._contents[index], index).items():
+                    self._sorted[by].append(entry)
+            for entries in self._sorted.values():
+                entries.sort()
+        return self._sorted
+
+    def sorted_items(self, by: str = "name", reverse: bool = False):
+        """ Return the stacks sorted by "name", "value" (price of the stack), "weight"
+            (weight of the stack) or "category" (then by value, highest first). """
+        if by not in ["name", "value", "weight", "category"]:
+            raise InventoryException(self, msg=f"Cannot sort items by {by}")
+        entries = self._build_sorted()[by]
+        return [entry[-1].copy() for entry in (reversed(entries) if reverse else entries)]
+
+    def top_n_by_value(self, n: int):
+        """ Return the n most valuable stacks (by price of the stack), most valuable first. """
+        entries = self._build_sorted()["value"]
+        return [entry[-1].copy() for entry in reversed(entries[max(0, len(entries) - n):])]
+
+    def heaviest(self, n: int = 1):
+        """ Return the n heaviest stacks, heaviest first. """
+        entries = self._build_sorted()["weight"]
+        return [entry[-1].copy() for entry in reversed(entries[max(0, len(entries) - n):])]
+
+    def items_in_category(self, category: Union[ItemCategory, None]):
+        """ Return the stacks of a category (None for generalized items),
+            most valuable first. """
+        entries = self._build_sorted()["category"]
+        category_key = (0, "") if category is None else (1, category.name)
+        return [entry[-1].copy() for entry in
+                entries[bisect.bisect_left(entries, (category_key,)):
+                        bisect.bisect_left(entries, (category_key, math.inf))]]
+
+    def _check_totals(self):
+        """ Compare the running totals against a full recount of the page.
+            Raises an InventoryException if they differ. """
+        cat_counts = {}
+        for x in self._contents:
+            cat_counts[x.category] = cat_counts.get(x.category, 0) + x.quantity
+
+        weight = sum([(x.unit_weight or 0) * x.quantity for x in self._contents])
+        if (not math.isclose(weight, self._total_weight, abs_tol=1e-9) or
+                sum([x.quantity for x in self._contents]) != self._num_items or
+                ({k: v for k, v in self._cat_counts.items() if v != 0} !=
+                 {k: v for k, v in cat_counts.items() if v != 0})):
+            raise InventoryException(self, msg="Running totals differ from recount")
+
     def _add_item(self, it: Item, new_slot=False):
         """ Add an item / a number of items to the inventory.
             Raises an InventoryException if item addition fails. """
@@ -466,23 +851,25 @@ class InventorySystem(jp.JSONEncodable):
         if not self.item_filter.accept(it):
             return self
 
+        self._claim()
+
         if self.weight_based and self.weight_limit > 0:
             # if the system is weight based.
             # stack limit is effectively infinite
             # max slots num is effectively infinite.
-            weight_in_inv = sum([x.unit_weight * x.quantity for x in self._contents])
-            possible_additional_weight = self.weight_limit - weight_in_inv
+            possible_additional_weight = self.weight_limit - self._total_weight
             possible_to_add = min(possible_additional_weight // it.unit_weight, it.quantity)
 
             if possible_to_add != it.quantity:
                 raise InventoryException(self, msg="Item added to full inventory")
 
-            if it in self._contents:
+            if it.item_type in self._index:
                 # if stack already exists
-                self._contents[self._contents.index(it)] += it
+                index = self._index[it.item_type][0]
+                self._set_slot(index, self._contents[index] + it)
             else:
                 # if need new stack
-                self._contents.append(it)
+                self._append_slot(it.copy())
         else:
             # if the system is stack and slot based.
             stack_limit = it.stack_limit
@@ -491,21 +878,23 @@ class InventorySystem(jp.JSONEncodable):
             if stack_limit is None:
                 stack_limit = self.stack_limit
 
-            if it in self._contents and not new_slot:
+            if it.item_type in self._index and not new_slot:
                 # if the item being added exists in the inventory page but we have
                 # not specified to create a new stack (say, because of a stack
                 # limit being hit)
-                in_lst = self._get_items(self._contents, it)
+                in_lst = self._get_slot_indices(it)
                 to_add = it.quantity
                 # while we can add more items to the stacks already in the inventory
                 while len(in_lst) > 0 and to_add > 0:
-                    next_it, in_lst = in_lst[0], in_lst[1:]
+                    next_ind, in_lst = in_lst[0], in_lst[1:]
+                    next_it = self._contents[next_ind]
                     can_add = to_add
 
                     if stack_limit is not None:
                         can_add = min(to_add, stack_limit - next_it.quantity)
                     to_add -= can_add
-                    next_it.quantity += can_add
+                    # stacks may be shared with copies of this page, so replace, never mutate.
+                    self._set_slot(next_ind, next_it.copy(quantity=next_it.quantity + can_add))
 
                 # if still more items left and all previous stacks are full,
                 if to_add > 0:
@@ -521,48 +910,49 @@ class InventorySystem(jp.JSONEncodable):
                 # make sure the number of slots occupied by items of the same category type
                 # is less than the category's max slot limit
                 msc_cat = it.category is None or it.category.max_slots is None or \
-                    len(list(filter(lambda x: x.category == it.category,
-                                    self._contents))) < it.category.max_slots
+                    self._cat_slots.get(it.category, 0) < it.category.max_slots
                 # make sure the number of slots occupied by the same item is less than the items
                 # max slot limit.
                 msc_item = it.max_slots is None or \
-                    len(list(filter(lambda x: x.name == it.name, self._contents))) < it.max_slots
+                    self._name_slots.get(it.name, 0) < it.max_slots
 
                 if msc_inv_sys and msc_cat and msc_item:
                     # adding new stacks.
                     to_add = it.quantity
 
                     if stack_limit is not None and to_add > stack_limit:
-                        self._contents.append(it.copy(quantity=stack_limit))
+                        self._append_slot(it.copy(quantity=stack_limit))
                         self._add_item(it.copy(quantity=to_add - stack_limit))
                     else:
-                        self._contents.append(it.copy())
+                        self._append_slot(it.copy())
                 else:
                     raise InventoryException(self, msg="Item added to full inventory")
 
-        num_items = sum([
-            x.quantity for x in self._contents
-        ])
-
-        self.kwargs.update({"num_items": num_items})
+        self.kwargs.update({"num_items": self._num_items})
         self.kwargs.update({"_contents": self._contents})
+        if self.debug_totals:
+            self._check_totals()
         return self
 
     def _remove_item(self, it: Item):
         """ Remove an item / a number of items from the inventory.
             Raises an InventoryException if item removal fails. """
-        if it not in self._contents:
+        if it.item_type not in self._index:
             raise InventoryException(self, msg="Cannot remove non-existent item")
-        it_lst = self._get_items(self._contents, it, full_stacks=True)
+
+        self._claim()
+
+        ind_lst = self._get_slot_indices(it, full_stacks=True)
         # sort by quantity low to high, to remove from smallest stacks first
-        it_lst.sort(key=lambda x: x.quantity)
+        ind_lst.sort(key=lambda i: self._contents[i].quantity)
 
         to_remove = it.quantity
 
-        while len(it_lst) > 0 and to_remove > 0:
-            next_it, it_lst = it_lst[0], it_lst[1:]
+        while len(ind_lst) > 0 and to_remove > 0:
+            next_ind, ind_lst = ind_lst[0], ind_lst[1:]
+            next_it = self._contents[next_ind]
             can_remove = min(next_it.quantity, to_remove)
-            next_it.quantity -= can_remove
+            self._set_slot(next_ind, next_it.copy(quantity=next_it.quantity - can_remove))
             to_remove -= can_remove
 
         # if we could not remove all items
@@ -571,8 +961,14 @@ class InventorySystem(jp.JSONEncodable):
                                      msg="Cannot remove more items")
 
         if self.remove_on_0:
-            self._contents = [x for x in self._contents if x.quantity != 0]
-
+            # drop from the highest index down, so moved stacks are never empty ones
+            for index in sorted(self._index[it.item_type], reverse=True):
+                if self._contents[index].quantity == 0:
+                    self._drop_slot(index)
+
+        self.kwargs.update({"num_items": self._num_items})
+        if self.debug_totals:
+            self._check_totals()
         return self
 
     def _get_items(self, lst, val, full_stacks=False):
@@ -581,15 +977,39 @@ class InventorySystem(jp.JSONEncodable):
                 (self.stack_limit is None or x.quantity < self.stack_limit
                  or (x.quantity == self.stack_limit and full_stacks))]
 
+    def _get_slot_indices(self, val, full_stacks=False):
+        """ Return the slot indices of stacks of kind `val` using the item index,
+            with the same stacks as _get_items on the page contents. """
+        return [i for i in self._index.get(val.item_type, ())
+                if self.stack_limit is None or self._contents[i].quantity < self.stack_limit
+                or (self._contents[i].quantity == self.stack_limit and full_stacks)]
+
     def get_contents(self):
-        return self._contents
+        """ Return copies of the stacks. Stacks are shared between copies of a page,
+            so the stored stacks are never handed out. """
+        return [it.copy() for it in self._contents]
+
+    @property
+    def total_weight(self):
+        """ Total weight of all items in the inventory page. """
+        return self._total_weight
+
+    @property
+    def num_items(self):
+        """ Total number of items (not stacks) in the inventory page. """
+        return self._num_items
+
+    @property
+    def category_counts(self):
+        """ Read-only mapping of category (None for generalized items) to number of items. """
+        return MappingProxyType(self._cat_counts)
 
     def set_stack_limit(self, stack_limit):
         """ Set new stack limit. Throws exception if new stack limit * max slots < current items
             stored in inventory. Increasing stack limit never causes exception. """
-        all_contents = self._contents
         self.stack_limit = stack_limit
-        self._contents = []
+        self.kwargs.update({"stack_limit": self.stack_limit})
+        all_contents = self._reset_slots()
         for item in all_contents:
             self._add_item(item)
 
@@ -597,9 +1017,9 @@ class InventorySystem(jp.JSONEncodable):
         """ Set new max number of slots limit. Throws exception if
             new max slots limit * stack limit < current items stored in inventory.
             Increasing max slots limit never causes exception. """
-        all_contents = self._contents
         self.max_slots = max_slots
-        self._contents = []
+        self.kwargs.update({"max_slots": self.max_slots})
+        all_contents = self._reset_slots()
         for item in all_contents:
             self._add_item(item)
 
@@ -609,7 +1029,7 @@ class InventorySystem(jp.JSONEncodable):
 
     def get_slots(self):
         """ Return a copy of the contents. """
-        return self._contents[::]
+        return [it.copy() for it in self._contents]
 
     def json_encode(self) -> dict:
         """ Serialize inventory into JSON. Not fully functional for nested custom classes. """
@@ -617,70 +1037,141 @@ class InventorySystem(jp.JSONEncodable):
 
     @classmethod
     def json_decode(cls, obj_json):
-        """ Turn dictionary back into Inventory System. """
+        """ Turn dictionary back into Inventory System. The stacks are stored in the slots
+            they were saved in, so slot deltas (see json_encode_delta) apply to the same
+            layout. """
         inv_sys = InventorySystem(**obj_json)
         for item in obj_json["_contents"]:
-            inv_sys += item
+            inv_sys._append_slot(item)
+        inv_sys.kwargs.update({"num_items": inv_sys._num_items})
         return inv_sys
 
+    def json_is_dirty(self) -> bool:
+        """ Whether any slot was written since the last checkpoint. """
+        return self._dirty_all or len(self._dirty) > 0
+
+    def json_mark_clean(self):
+        """ Mark the current slots as saved. """
+        self._dirty = set()
+        self._dirty_all = False
+
+    def json_encode_delta(self):
+        """ Encode the slots written since the last checkpoint and the number of slots,
+            or the page itself if it was created or reset since then. """
+        if self._dirty_all:
+            return self
+        return {
+            "num_slots": len(self._contents),
+            "slots": [[i, self._contents[i]] for i in sorted(self._dirty)
+                      if i < len(self._contents)],
+        }
+
+    def json_apply_delta(self, delta: dict):
+        """ Apply a delta from json_encode_delta, keeping the slot order. """
+        contents = self._contents[:delta["num_slots"]]
+        contents += [None] * (delta["num_slots"] - len(contents))
+        for i, it in delta["slots"]:
+            contents[i] = it
+
+        self._reset_slots()
+        for it in contents:
+            self._append_slot(it)
+        self.kwargs.update({"num_items": self._num_items})
+        return self
+
+
+def _filter_signature(filters: List[ItemFilter]):
+    """ Hashable configuration of the filters of an inventory's pages, in page order. """
+    return tuple(tuple(item_filter.filter_cats.items()) for item_filter in filters)
+
+
+# filter configuration -> warnings for an inventory with pages of those filters.
+_validation_cache = {}
+_validation_cache_size = 256
+
 
 class Inventory(jp.JSONEncodable):
     """ Collection of Inventory Systems. """
+    # json_pickler.dump writes one page at a time.
+    json_stream_field = "pages"
+
     def __init__(self, **kwargs):
         """ Create an inventory (collection of inventory pages). """
+        # category -> index of the page accepting it, compiled from the page filters
+        # when first needed (see route), and the filter signature it was compiled for.
+        self._routes = None
+        self._default_route = None
+        self._route_signature = None
+
         self.pages = list(kwargs.get("pages", [
             InventorySystem(item_filter=ItemFilter(accept_all=True))
         ]))
         self.all_pages_in_str = bool(kwargs.get("all_pages_in_str", True))
         self.page_display = int(kwargs.get("page_display", 0))
 
+        # settings and page count at the last checkpoint, None if never checkpointed.
+        self._clean_state = None
+
+        # the checks only depend on the page filters, so their result is cached per
+        # filter configuration. validate=False skips them, for trusted page layouts.
+        if kwargs.get("validate", True):
+            for message in Inventory._validate_filters([page.item_filter for page in self.pages]):
+                warnings.warn(message)
+
+    @staticmethod
+    def _validate_filters(filters: List[ItemFilter]):
+        """ Return the warnings for pages with the given filters overlapping (accepting
+            the same items). Results are cached per filter configuration. """
+        signature = _filter_signature(filters)
+        if signature in _validation_cache:
+            return _validation_cache[signature]
+
+        messages = []
+
         # all categories accepted by all pages of the inventory.
-        all_cats = sum([
-            inv_sys.item_filter.get_categories() for inv_sys in self.pages
-        ], start=[])
+        all_cats = sum([item_filter.get_categories() for item_filter in filters], start=[])
 
         all_cats_set = set(all_cats)
 
         if len(all_cats_set) != len(all_cats):
             # at least 2 pages share a category they accept
-            warnings.warn("Multiple pages accept similar items.")
+            messages.append("Multiple pages accept similar items.")
 
-        if len([inv_sys for inv_sys in self.pages if inv_sys.item_filter.is_generalized()]) > 1:
+        if len([f for f in filters if f.is_generalized()]) > 1:
             # at least 2 pages accept generalized items
-            warnings.warn("Multiple pages are generalized.")
+            messages.append("Multiple pages are generalized.")
 
-        if len([inv_sys for inv_sys in self.pages if inv_sys.item_filter.is_categorized()]) > 1:
+        if len([f for f in filters if f.is_categorized()]) > 1:
             # at least 2 pages accept any categorized items
-            warnings.warn("Multiple pages are categorized.")
+            messages.append("Multiple pages are categorized.")
 
-        if len([inv_sys for inv_sys in self.pages
-                if inv_sys.item_filter.is_all_encompassing()]) >= 1 and len(self.pages) > 1:
+        if len([f for f in filters if f.is_all_encompassing()]) >= 1 and len(filters) > 1:
             # all encompassing page exists while other pages exist as well.
-            warnings.warn("Multiple pages defined with an all encompassing page.")
-
-        for inv_sys in [inv_sys for inv_sys in self.pages if inv_sys.item_filter.is_categorized()]:
-            restrictions = inv_sys.item_filter.get_restricted()
-            inner_break = False
-            for cat in all_cats_set:
-                if cat is not None and cat not in restrictions:
-                    # two categories accept the same kinds of items (or partial overlap)
-                    warnings.warn(f"Inventory System does not restrict other systems' acceptances.")
-                    inner_break = True
-                    break
-            if inner_break:
+            messages.append("Multiple pages defined with an all encompassing page.")
+
+        for item_filter in [f for f in filters if f.is_categorized()]:
+            restrictions = item_filter.get_restricted()
+            if any(cat is not None and cat not in restrictions for cat in all_cats_set):
+                # two categories accept the same kinds of items (or partial overlap)
+                messages.append("Inventory System does not restrict other systems' acceptances.")
                 break
 
         # last check to ensure nothing has gone wrong (blanket warning)
         # this is in place in case the above more specific cases don't catch an issue
         # in this case, debugging the issue is more difficult.
-        for category in list(all_cats_set) + [ItemCategory("random:"+str(random.random()))]:
-            num_accepting = 0
-            for inv_sys in self.pages:
-                if inv_sys.item_filter.accepts(category):
-                    num_accepting += 1
+        for category in all_cats_set:
+            if len([f for f in filters if f.accepts(category)]) > 1:
+                messages.append(f"Multiple inventory systems accept category {category}.")
 
-            if num_accepting > 1:
-                warnings.warn(f"Multiple inventory systems accept category {category}.")
+        # a category no filter lists is accepted by every page accepting any category.
+        if len([f for f in filters if f.filter_cats[Any]]) > 1:
+            messages.append("Multiple inventory systems accept categories not listed "
+                            "in any filter.")
+
+        if len(_validation_cache) >= _validation_cache_size:
+            _validation_cache.clear()
+        _validation_cache[signature] = messages
+        return messages
 
     def __str__(self):
         """ Return the string representation of an inventory (can display multiple
@@ -689,13 +1180,15 @@ class Inventory(jp.JSONEncodable):
             return str(self.pages[self.page_display]) + "\n " + \
                    str(self.page_display+1) + "/" + str(len(self.pages))
 
-        max_lines = max([len(str(page).split("\n")) for page in self.pages], default=0)
+        page_lines = [str(page).split("\n") for page in self.pages]
+
+        max_lines = max([len(lines) for lines in page_lines], default=0)
 
-        widths = [len(str(page).split("\n")[0]) for page in self.pages]
+        widths = [len(lines[0]) for lines in page_lines]
 
         page_str_s = [
-            str(self.pages[i]).split("\n") + [
-                " " * widths[i] for _ in range(max_lines - len(str(self.pages[i]).split("\n")))
+            page_lines[i] + [
+                " " * widths[i] for _ in range(max_lines - len(page_lines[i]))
             ] for i in range(len(self.pages))
         ]
 
@@ -706,36 +1199,129 @@ class Inventory(jp.JSONEncodable):
 
     def __add__(self, other: Union[List[Item], Item]):
         """ Add a single item or list of items to the inventory. """
-        inv_copy = copy.deepcopy(self)
         if type(other) == Item:
             # add a single item
             other = [other]
-        for it in other:
-            it_cat = it.category
-            for i in range(len(inv_copy.pages)):
-                if inv_copy.pages[i].item_filter.accepts(it_cat):
-                    inv_copy.pages[i] += it
-
-                    # TODO: allow multiple pages and proper item addition to different systems.
-                    #  - can probably accomplish using additional method in InventorySystem
-                    #    and a try/catch which catches InventoryExceptions on +=
-
-                    break
-        return inv_copy
+        return self._copy().apply_batch(adds=other)
 
     def __sub__(self, other: Union[List[Item], Item]):
         """ Remove items from the inventory. """
-        inv_copy = copy.deepcopy(self)
         if type(other) == Item:
             # remove a single item
             other = [other]
-        for it in other:
-            it_cat = it.category
-            for i in range(len(inv_copy.pages)):
-                if inv_copy.pages[i].item_filter.accepts(it_cat):
-                    inv_copy.pages[i] -= it
+        return self._copy().apply_batch(removes=other)
+
+    @property
+    def pages(self):
+        """ Inventory pages. The routing table follows changes to the pages and their filters. """
+        return self._pages
+
+    @pages.setter
+    def pages(self, pages):
+        """ Set the inventory pages, invalidating the routing table. """
+        self._pages = pages
+        self.invalidate_routes()
+
+    def _copy(self):
+        """ Return an independent copy of the inventory. Each page is a new page object
+            sharing its slots with the original page until either one is written to. """
+        inv_copy = object.__new__(self.__class__)
+        inv_copy.__dict__.update(self.__dict__)
+        # same page filters, so the routing table is shared as well
+        inv_copy._pages = [page._cow_copy() for page in self._pages]
         return inv_copy
 
+    def _page_index(self, item_category: Union[ItemCategory, None]):
+        """ Return the index of the first page accepting the category, or None. """
+        for i in range(len(self.pages)):
+            if self.pages[i].item_filter.accepts(item_category):
+                return i
+        return None
+
+    def invalidate_routes(self):
+        """ Drop the routing table, it is compiled again from the page filters when needed. """
+        self._routes = None
+
+    def _check_routes(self):
+        """ Compile the routing table if there is none, or if a page was added, removed or
+            replaced or a page filter was changed since it was compiled. """
+        signature = _filter_signature([page.item_filter for page in self._pages])
+        if self._routes is None or signature != self._route_signature:
+            self._compile_routes()
+            self._route_signature = signature
+
+    def _compile_routes(self):
+        """ Compile the page filters into a table of category -> page index. """
+        categories = {c for page in self._pages for c in page.item_filter.filter_cats
+                      if c is not Any}
+        self._routes = {c: self._page_index(c) for c in categories | {None}}
+        # categories no filter mentions go to the first page accepting any category
+        self._default_route = next((i for i in range(len(self._pages))
+                                    if self._pages[i].item_filter.filter_cats[Any]), None)
+
+    def route(self, item_category: Union[ItemCategory, None]):
+        """ Return the index of the page that items of the category are added to,
+            or None if no page accepts them. """
+        self._check_routes()
+        return self._routes.get(item_category, self._default_route)
+
+    def route_many(self, items: List[Item]):
+        """ Group items by the index of the page they are added to, keeping their order.
+            Items no page accepts are left out. """
+        self._check_routes()
+        routes, default_route = self._routes, self._default_route
+
+        groups = {}
+        for it in items:
+            i = routes.get(it.category, default_route)
+            if i is not None:
+                groups.setdefault(i, []).append(it)
+        return groups
+
+    def top_n_by_value(self, n: int):
+        """ Return the n most valuable stacks of all pages, most valuable first. """
+        return heapq.nlargest(n, [it for page in self.pages for it in page.top_n_by_value(n)],
+                              key=lambda it: (it.unit_price or 0) * it.quantity)
+
+    def heaviest(self, n: int = 1):
+        """ Return the n heaviest stacks of all pages, heaviest first. """
+        return heapq.nlargest(n, [it for page in self.pages for it in page.heaviest(n)],
+                              key=lambda it: (it.unit_weight or 0) * it.quantity)
+
+    def items_in_category(self, category: Union[ItemCategory, None]):
+        """ Return the stacks of a category from all pages, most valuable first. """
+        return list(heapq.merge(*[page.items_in_category(category) for page in self.pages],
+                                key=lambda it: -(it.unit_price or 0) * it.quantity))
+
+    def apply_batch(self, adds: List[Item] = None, removes: List[Item] = None):
+        """ Remove and then add a batch of items. Every page is copied at most once and
+            the changes are committed together, so either the whole batch is applied or
+            an InventoryException is raised and the inventory is left unchanged.
+            Items not accepted by any page are ignored. """
+        pages = list(self._pages)
+        copied = set()
+
+        for items, change in [(removes, InventorySystem._remove_item),
+                              (adds, InventorySystem._add_item)]:
+            for i, page_items in self.route_many(items or []).items():
+                if i not in copied:
+                    pages[i] = pages[i]._cow_copy()
+                    copied.add(i)
+                for it in page_items:
+                    change(pages[i], it)
+
+        # commit, the copied pages have the same filters so the routes stay valid
+        self._pages = pages
+        return self
+
+    @contextmanager
+    def transaction(self):
+        """ Collect items to add and remove, applying them as a single batch
+            (see apply_batch) when the block exits without an exception. """
+        batch = InventoryTransaction()
+        yield batch
+        self.apply_batch(adds=batch.adds, removes=batch.removes)
+
     def __eq__(self, other):
         if type(other) == Inventory:
             if self.all_pages_in_str != other.all_pages_in_str:
@@ -763,13 +1349,215 @@ class Inventory(jp.JSONEncodable):
     def json_decode(cls, obj_json):
         return Inventory(**obj_json)
 
+    def _json_state(self):
+        """ Settings and page count, compared against the last checkpoint. """
+        return self.all_pages_in_str, self.page_display, len(self.pages)
+
+    def json_is_dirty(self) -> bool:
+        """ Whether a setting or page changed since the last checkpoint. """
+        return (self._clean_state != self._json_state() or
+                any(page.json_is_dirty() for page in self.pages))
+
+    def json_mark_clean(self):
+        """ Mark the current settings and pages as saved. """
+        for page in self.pages:
+            page.json_mark_clean()
+        self._clean_state = self._json_state()
+
+    def json_encode_delta(self):
+        """ Encode the settings and the deltas of the pages changed since the last
+            checkpoint, or the inventory itself if it was never checkpointed. """
+        if self._clean_state is None:
+            return self
+        return {
+            "all_pages_in_str": self.all_pages_in_str,
+            "page_display": self.page_display,
+            "num_pages": len(self.pages),
+            "pages": [[i, self.pages[i].json_encode_delta()] for i in range(len(self.pages))
+                      if self.pages[i].json_is_dirty()],
+        }
+
+    def json_apply_delta(self, delta: dict):
+        """ Apply a delta from json_encode_delta. """
+        pages = self.pages[:delta["num_pages"]]
+        pages += [None] * (delta["num_pages"] - len(pages))
+        for i, page_delta in delta["pages"]:
+            pages[i] = jp.apply_delta(pages[i], page_delta)
+
+        self.pages = pages
+        self.all_pages_in_str = delta["all_pages_in_str"]
+        self.page_display = delta["page_display"]
+        return self
+
+
+class InventoryTransaction:
+    """ Batch of items to add to and remove from an inventory, see Inventory.transaction. """
+    def __init__(self):
+        """ Create an empty batch. """
+        self.adds = []
+        self.removes = []
+
+    def __add__(self, other: Union[List[Item], Item]):
+        """ Queue a single item or list of items to be added. """
+        self.adds += [other] if type(other) == Item else list(other)
+        return self
+
+    def __sub__(self, other: Union[List[Item], Item]):
+        """ Queue a single item or list of items to be removed. """
+        self.removes += [other] if type(other) == Item else list(other)
+        return self
+
+
+class InventoryTemplate:
+    """ Page layout and starting contents for stamping out many inventories, such as
+        merchant or chest inventories. The layout is validated and the contents are
+        added once; spawned inventories share the template's stacks (copy-on-write). """
+    def __init__(self, pages: List[InventorySystem] = None, items: List[Item] = None,
+                 **kwargs):
+        """ Create a template from pages (copied, so changing them later does not change
+            the template), the items to start with and any other Inventory arguments. """
+        if pages is not None:
+            kwargs["pages"] = [page._cow_copy() for page in pages]
+        self._prototype = Inventory(**kwargs).apply_batch(adds=items)
+
+    def spawn(self):
+        """ Return a new inventory with the template's layout and contents. """
+        return self._prototype._copy()
+
+    def spawn_many(self, n: int):
+        """ Return a list of n new independent inventories, see spawn. """
+        return [self.spawn() for _ in range(n)]
+
+
+class RegistryIndex(MutableMapping):
+    """ Dictionary-like price registry stored in an sqlite index. Entries are looked up
+        lazily, and each write only changes the row of that entry. Entries written one at
+        a time are also kept as additions, which survive rebuilding the index. """
+    # maximum number of names looked up in a single query
+    query_size = 500
+
+    def __init__(self, index_path: str = ":memory:"):
+        """ Open (or create) the sqlite index at index_path. """
+        self.index_path = index_path
+        self.connection = sqlite3.connect(index_path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS registry "
+                                "(name TEXT PRIMARY KEY, price)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS additions "
+                                "(name TEXT PRIMARY KEY, price)")
+        self.connection.commit()
+        # the connection is closed by close, or once the index is garbage collected.
+        self._finalizer = weakref.finalize(self, self.connection.close)
+
+    def __getitem__(self, item_name: str):
+        """ Look up the price of a single item. """
+        row = self.connection.execute("SELECT price FROM registry WHERE name = ?",
+                                      (item_name,)).fetchone()
+        if row is None:
+            raise KeyError(item_name)
+        return row[0]
+
+    def __setitem__(self, item_name: str, item_price: int):
+        """ Write the price of a single item. """
+        for table in ["registry", "additions"]:
+            self.connection.execute(f"INSERT OR REPLACE INTO {table} (name, price) VALUES (?, ?)",
+                                    (item_name, item_price))
+        self.connection.commit()
+
+    def __delitem__(self, item_name: str):
+        """ Remove a single item from the index. """
+        self.connection.execute("DELETE FROM additions WHERE name = ?", (item_name,))
+        if self.connection.execute("DELETE FROM registry WHERE name = ?",
+                                   (item_name,)).rowcount == 0:
+            self.connection.rollback()
+            raise KeyError(item_name)
+        self.connection.commit()
+
+    def __iter__(self):
+        """ Iterate over item names in the order they were first added. """
+        for row in self.connection.execute("SELECT name FROM registry ORDER BY rowid"):
+            yield row[0]
+
+    def __len__(self):
+        """ Number of items in the index. """
+        return self.connection.execute("SELECT COUNT(*) FROM registry").fetchone()[0]
+
+    def items(self):
+        """ Iterate over (name, price) pairs with a single query. """
+        return self.connection.execute("SELECT name, price FROM registry ORDER BY rowid")
+
+    def get_many(self, item_names: List[str]):
+        """ Return a dictionary of name to price for the names found in the index. """
+        item_names = list(item_names)
+        found = {}
+        for i in range(0, len(item_names), self.query_size):
+            names = item_names[i:i + self.query_size]
+            found.update(self.connection.execute(
+                "SELECT name, price FROM registry WHERE name IN (" +
+                ", ".join(["?"] * len(names)) + ")", names))
+        return found
+
+    def update_many(self, entries: Dict[str, int]):
+        """ Write many entries in a single transaction. """
+        self.connection.executemany("INSERT OR REPLACE INTO registry (name, price) VALUES (?, ?)",
+                                    entries.items())
+        self.connection.commit()
+
+    def rebuild(self, entries: Dict[str, int]):
+        """ Replace the entries with the given entries followed by the additions, in a
+            single transaction, so the index is left as it was if anything fails. """
+        try:
+            self.connection.execute("DELETE FROM registry")
+            self.connection.executemany("INSERT OR REPLACE INTO registry (name, price) "
+                                        "VALUES (?, ?)", entries.items())
+            self.connection.execute("INSERT OR REPLACE INTO registry (name, price) "
+                                    "SELECT name, price FROM additions ORDER BY rowid")
+        except BaseException:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+
+    def close(self):
+        """ Close the connection to the index. """
+        self._finalizer()
+
 
 class PriceRegistry(jp.JSONEncodable):
     """ Represents a unified list for any shopkeeper npc to use to buy items from the player. """
     def __init__(self, registry: dict[str, int] = None,
                  read_file: Union[TextIOWrapper, Union[IO, IO[bytes]]] = None,
-                 read_file_path: str = None):  # file path to open itself
-        """ Create a price registry from file. """
+                 read_file_path: str = None,  # file path to open itself
+                 storage: str = "dict",
+                 index_path: str = None,
+                 read_only: bool = False):
+        """ Create a price registry from file. With storage="dict" (default) the whole
+            registry is held in memory. With storage="sqlite" entries are held in an sqlite
+            index at index_path (by default next to read_file_path, with a .sqlite extension),
+            which is built from the registry file only when missing or older than the file.
+            Entries added to an sqlite registry are kept in the index (not the file), and
+            are kept when the index is rebuilt from the file.
+            A read only registry can be shared, and raises an exception when added to. """
+        if storage not in ["dict", "sqlite"]:
+            raise InventoryException(None, msg=f"Unknown registry storage {storage}")
+        self.storage = storage
+
+        if storage == "sqlite":
+            if index_path is None:
+                index_path = (":memory:" if read_file_path is None else
+                              os.path.splitext(read_file_path)[0] + ".sqlite")
+
+            index_outdated = not os.path.exists(index_path) or (
+                read_file_path is not None and os.path.exists(read_file_path) and
+                os.path.getmtime(read_file_path) > os.path.getmtime(index_path))
+            self.registry = RegistryIndex(index_path)
+
+            # only parse the registry file when the index must be (re)built
+            if read_file is None and not index_outdated:
+                read_file_path = None
+        else:
+            self.registry = registry
+            if registry is None:
+                self.registry = {}
+
         # read_file -> direct file / text io object to read from
         if read_file is None and read_file_path is not None:
             try:
@@ -783,45 +1571,153 @@ class PriceRegistry(jp.JSONEncodable):
         self.read_file = read_file
         self.read_file_path = read_file_path
 
-        self.registry = registry
-        if registry is None:
-            self.registry = {}
+        if storage == "sqlite" and registry is not None:
+            self.registry.update_many(registry)
 
         if read_file is not None:
             try:
-                self.registry = json.loads(read_file.read())
+                if storage == "sqlite":
+                    # parsed before the index is touched, so a corrupted file changes nothing
+                    self.registry.rebuild(json.loads(read_file.read()))
+                else:
+                    self.registry = json.loads(read_file.read())
             except json.decoder.JSONDecodeError:
                 warnings.warn(f"Registry file {read_file_path} corrupted.")
-                self.registry = {}
+                if storage == "dict":
+                    self.registry = {}
             finally:
                 read_file.close()
 
+        self.read_only = read_only
+        if read_only and storage == "dict":
+            self.registry = MappingProxyType(self.registry)
+
     def __str__(self):
         """ Represent the registry as a list of items and prices. """
         return "\n".join([k + " -> " + str(v) for k, v in self.registry.items()])
 
     def __eq__(self, other):
         if type(other) == PriceRegistry:
-            return self.registry == other.registry
+            return dict(self.registry.items()) == dict(other.registry.items())
         else:
             return False
 
     def add_to_registry(self, item_name: str, item_price: int):
         """ Add a new entry to the registry. """
+        if self.read_only:
+            raise InventoryException(None, msg="Cannot add to read only registry")
         self.registry.update({item_name: item_price})
 
     def read_from_registry(self, item_name: str):
         """ Retrieve the entry from the registry. """
         return self.registry.get(item_name, None)
 
+    def read_many(self, item_names: List[str]):
+        """ Retrieve the entries of many items, as a dictionary of name to price
+            (None for items not in the registry). """
+        if self.storage == "sqlite":
+            found = self.registry.get_many(item_names)
+        else:
+            found = self.registry
+        return {item_name: found.get(item_name, None) for item_name in item_names}
+
+    def close(self):
+        """ Close the sqlite index, if the registry uses one. """
+        if self.storage == "sqlite":
+            self.registry.close()
+
     def json_encode(self) -> dict:
         """ Encode registry as JSON, so return registry of strings and integers. """
-        return {"registry": self.registry}
+        return {"registry": dict(self.registry.items())}
 
     @classmethod
     def json_decode(cls, obj_json):
         return PriceRegistry(registry=obj_json['registry'])
 
+    @staticmethod
+    def shared(read_file_path: str, storage: str = "dict"):
+        """ Return a read only registry for the file, shared through the registry cache. """
+        return registry_cache.get(read_file_path, storage=storage)
+
+
+class RegistryCache:
+    """ Cache of read only price registries keyed by file path, so shopkeepers reading the
+        same registry file share one registry. An entry is reloaded when the file's
+        modification time or size changes, and the least recently used entries are evicted
+        once more than max_entries registries are cached. Registries leaving the cache are
+        not closed, since shopkeepers may still use them; a registry's sqlite index is
+        closed once its last user releases it. """
+    def __init__(self, max_entries: int = 16):
+        """ Create an empty cache. """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    def __len__(self):
+        """ Number of cached registries. """
+        return len(self.entries)
+
+    @staticmethod
+    def _file_stamp(read_file_path: str):
+        """ Modification time and size of the file, or None if it does not exist. """
+        try:
+            stat = os.stat(read_file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, read_file_path: str, storage: str = "dict"):
+        """ Return the shared registry for the file, loading it if it is not cached
+            or if the file changed since it was loaded. """
+        key = (os.path.abspath(read_file_path), storage)
+        stamp = self._file_stamp(read_file_path)
+
+        if key in self.entries:
+            cached_stamp, registry = self.entries[key]
+            if cached_stamp == stamp:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return registry
+            self.reloads += 1
+            self.evict(read_file_path, storage=storage)
+        else:
+            self.misses += 1
+
+        registry = PriceRegistry(read_file_path=read_file_path, storage=storage, read_only=True)
+        self.entries[key] = (stamp, registry)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+        return registry
+
+    def evict(self, read_file_path: str, storage: str = "dict"):
+        """ Remove the registry for the file from the cache, if cached. """
+        self.entries.pop((os.path.abspath(read_file_path), storage), None)
+
+    def clear(self):
+        """ Remove all registries from the cache. """
+        self.entries.clear()
+
+    def stats(self):
+        """ Return the cache counters as a dictionary. """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "evictions": self.evictions,
+            "entries": len(self.entries)
+        }
+
+
+# registry cache used by PriceRegistry.shared
+registry_cache = RegistryCache()
+
 
 class Wallet(jp.JSONEncodable):
     """ Represents a wallet that can store amounts of a
@@ -832,122 +1728,130 @@ class Wallet(jp.JSONEncodable):
             raise CurrencyException(msg="Cannot have indebted wallet.")
         if curr_sys is None:
             curr_sys = CurrencySystem()
-        self.wallet = {denomination: 0 for denomination in curr_sys.denominations}
-        lowest_denomination = curr_sys.denominations[-1]
-        self.wallet[lowest_denomination] = amount
         self.curr_sys = curr_sys
-        self.auto_stack()
+        # the balance is held in the lowest denomination, the breakdown into
+        # each denomination is only computed when asked for.
+        self._amount = amount
+        # whether the balance changed since the last checkpoint.
+        self._dirty = True
+
+    @property
+    def amount(self):
+        """ Balance in the lowest valued denomination. """
+        return self._amount
+
+    @amount.setter
+    def amount(self, amount):
+        """ Set the balance in the lowest valued denomination. """
+        self._amount = amount
+        self._dirty = True
+
+    @property
+    def wallet(self):
+        """ Amount of each denomination, stacked from highest value to lowest value. """
+        new_wallet = OrderedDict()
+        remaining = self.amount
+        for denomination, multiplier in zip(self.curr_sys.denominations,
+                                            self.curr_sys.multipliers):
+            new_wallet[denomination], remaining = divmod(remaining, multiplier)
+        return new_wallet
+
+    @wallet.setter
+    def wallet(self, wallet):
+        """ Set the balance from an amount of each denomination. """
+        self.amount = self.unstack(wallet=wallet)
 
     def __str__(self):
         """ Return as block, where each line represents a certain denomination and the amount
             the wallet contains of that denomination. """
         max_len = max([len(denomination) for denomination in self.curr_sys.denominations],
                       default=0)
+        wallet = self.wallet
         return "\n".join(
             [
                 denomination + ": " + " " * (max_len - len(denomination)) +
-                str(self.wallet[denomination]) for denomination in self.curr_sys.denominations
+                str(wallet[denomination]) for denomination in self.curr_sys.denominations
             ]
         )
 
     def __add__(self, other: Wallet):
         """ Returns self + other in terms of currency amounts. """
-        return Wallet(curr_sys=self.curr_sys, amount=(self.unstack() + other.unstack()))
+        return Wallet(curr_sys=self.curr_sys, amount=(self.amount + other.amount))
 
     def __sub__(self, other: Wallet):
         """ Returns self - other in terms of currency amounts. """
-        return Wallet(curr_sys=self.curr_sys, amount=(self.unstack() - other.unstack()))
+        return Wallet(curr_sys=self.curr_sys, amount=(self.amount - other.amount))
 
     def __gt__(self, other):
         """ Returns self > other in terms of currency amounts. """
-        return self.unstack().__gt__(other.unstack())
+        return self.amount > other.amount
 
     def __lt__(self, other):
         """ Returns self < other in terms of currency amounts. """
-        return self.unstack().__lt__(other.unstack())
+        return self.amount < other.amount
 
     def __ge__(self, other):
         """ Returns self >= other in terms of currency amounts. """
-        return self.unstack().__ge__(other.unstack())
+        return self.amount >= other.amount
 
     def __le__(self, other):
         """ Returns self <= other in terms of currency amounts. """
-        return self.unstack().__le__(other.unstack())
+        return self.amount <= other.amount
 
     def __eq__(self, other):
         """ Returns self == other in terms of currency amounts. """
         if type(other) == Wallet:
-            return self.unstack().__eq__(other.unstack())
+            return self.amount == other.amount
         else:
             return False
 
     def __ne__(self, other):
         """ Returns self != other in terms of currency amounts. """
-        return self.unstack().__ne__(other.unstack())
+        return not self.__eq__(other)
 
     def add_currency(self, denomination, amount, auto_stack=True):
         """ Adds amount of denomination to wallet, returns True on successful addition,
-            False on unsuccessful addition. """
-        try:
-            self.wallet[denomination] += amount
-            if auto_stack:
-                self.auto_stack()
-            return True
-        except KeyError:
+            False on unsuccessful addition. The balance is always stacked, auto_stack
+            is kept for compatibility. """
+        index = self.curr_sys.denomination_index.get(denomination, None)
+        if index is None:
             return False
 
-    def auto_stack(self):
-        """ Stack currency from highest value to lowest value. Inverse of unstack method. """
-        lowest_denomination = self.curr_sys.denominations[-1]
-        total_amount = self.unstack()
-
-        new_wallet = OrderedDict({
-            denomination: 0 for denomination in self.curr_sys.denominations
-        })
-
-        current_value = 0
-        for denomination in self.curr_sys.denominations:
-            amount = self.curr_sys.convert(lowest_denomination,
-                                           total_amount - current_value,
-                                           denomination,
-                                           whole_number=True)
-            current_value += self.curr_sys.convert(denomination,
-                                                   amount,
-                                                   lowest_denomination)
-            new_wallet[denomination] = amount
-
-        # ensure old value and new value are the same.
+        new_amount = self.amount + amount * self.curr_sys.multipliers[index]
+        if new_amount < 0:
+            raise CurrencyException(self, msg="Cannot have indebted wallet.")
+        self.amount = new_amount
+        return True
 
-        if self.unstack() != self.unstack(wallet=new_wallet):
-            raise CurrencyException(msg="Auto stack method created differently valued wallet.")
-
-        self.wallet = new_wallet
+    def auto_stack(self):
+        """ Stack currency from highest value to lowest value. Inverse of unstack method.
+            The balance is stored unstacked and broken down on demand, so this does nothing. """
+        pass
 
     def unstack(self, wallet=None):
         """ Return the amount this wallet is worth in it's lowest valued denomination.
             Inverse of auto_stack method. """
         if wallet is None:
-            wallet = self.wallet
-        lowest_denomination = self.curr_sys.denominations[-1]
-        amount = 0
-        for denomination in self.curr_sys.denominations:
-            amount += self.curr_sys.convert(denomination,
-                                            wallet[denomination],
-                                            lowest_denomination)
+            return self.amount
 
-        return amount
+        return sum([wallet[denomination] * multiplier
+                    for denomination, multiplier in zip(self.curr_sys.denominations,
+                                                        self.curr_sys.multipliers)])
 
     def json_encode(self) -> dict:
         """ Encode wallet as JSON dictionary. """
         return {
-            "curr_sys": self.curr_sys.json_encode(),
+            "curr_sys": self.curr_sys,
             "wallet": self.wallet
         }
 
     @classmethod
     def json_decode(cls, obj_json):
 
-        curr_sys = CurrencySystem.json_decode(obj_json['curr_sys'])
+        curr_sys = obj_json['curr_sys']
+        if not isinstance(curr_sys, CurrencySystem):
+            # plain dictionary, as encoded by older versions
+            curr_sys = CurrencySystem.json_decode(curr_sys)
         wallet = obj_json['wallet']
 
         ret_val = Wallet(curr_sys=curr_sys)
@@ -957,10 +1861,29 @@ class Wallet(jp.JSONEncodable):
 
         return ret_val
 
+    def json_is_dirty(self) -> bool:
+        """ Whether the balance changed since the last checkpoint. """
+        return self._dirty
+
+    def json_mark_clean(self):
+        """ Mark the current balance as saved. """
+        self._dirty = False
+
+    def json_encode_delta(self):
+        """ Encode the balance, the currency system is fixed for a wallet. """
+        return {"wallet": self.wallet}
+
+    def json_apply_delta(self, delta: dict):
+        """ Apply a delta from json_encode_delta. """
+        self.wallet = delta["wallet"]
+        return self
+
 
 class CurrencySystem(jp.JSONEncodable):
     """ Represents a Currency system, like Gold, Silver and Copper pieces,
         where 1 gold = 7 silver, 1 silver = 13 copper etc. """
+    json_value_object = True
+
     def __init__(self, relative_denominations: OrderedDict[str, int] = None):
         """
         For all denominations other than the highest valued denomination (first entry),
@@ -983,7 +1906,16 @@ class CurrencySystem(jp.JSONEncodable):
             raise CurrencyException(msg="Cannot have most valued denomination worth != 1",
                                     cause=self)
 
+        # worth of each denomination in the lowest valued denomination.
+        self.denomination_index = {d: i for i, d in enumerate(self.denominations)}
+        self.multipliers = [1] * len(self.denominations)
+        for i in range(len(self.denominations) - 2, -1, -1):
+            self.multipliers[i] = (self.multipliers[i + 1] *
+                                   self.relative_denominations[self.denominations[i + 1]])
+
     def __eq__(self, other):
+        if other is self:
+            return True
         if type(other) == CurrencySystem:
             return self.relative_denominations == other.relative_denominations
         else:
@@ -997,18 +1929,17 @@ class CurrencySystem(jp.JSONEncodable):
         if denomination1 == denomination2:
             return amount
 
-        ind1 = list(self.relative_denominations.keys()).index(denomination1)
-        ind2 = list(self.relative_denominations.keys()).index(denomination2)
+        multiplier1 = self.multipliers[self.denomination_index[denomination1]]
+        multiplier2 = self.multipliers[self.denomination_index[denomination2]]
 
         # if denomination1 is a more valuable denomination
-        while ind1 < ind2:
-            ind1 += 1
-            amount *= self.relative_denominations[self.denominations[ind1]]
-
-        # if denomination2 is a more valuable denomination
-        while ind1 > ind2:
-            amount /= self.relative_denominations[self.denominations[ind1]]
-            ind1 -= 1
+        if multiplier1 >= multiplier2:
+            amount *= multiplier1 // multiplier2
+        # if denomination2 is a more valuable denomination, keep integers exact
+        elif whole_number and type(amount) == int:
+            return amount // (multiplier2 // multiplier1)
+        else:
+            amount /= multiplier2 // multiplier1
 
         # round if necessary
         if whole_number:
@@ -1016,6 +1947,49 @@ class CurrencySystem(jp.JSONEncodable):
 
         return amount
 
+    def convert_many(self, denomination1: str, amounts: np.ndarray, denomination2: str):
+        """ Convert an array of amounts of denomination1 into whole amounts of denomination2.
+            Each entry is equal to convert(denomination1, amount, denomination2, whole_number=True).
+            Integer arrays which could overflow 64 bits are converted using Python integers. """
+        amounts = np.asarray(amounts)
+
+        # as with convert, no conversion (or rounding) between the same denomination
+        if denomination1 == denomination2:
+            return amounts.copy()
+
+        multiplier1 = self.multipliers[self.denomination_index[denomination1]]
+        multiplier2 = self.multipliers[self.denomination_index[denomination2]]
+
+        if amounts.dtype.kind == 'f':
+            if multiplier1 >= multiplier2:
+                amounts = amounts * (multiplier1 // multiplier2)
+            else:
+                amounts = amounts / (multiplier2 // multiplier1)
+            return np.floor(amounts).astype(np.int64)
+
+        if multiplier1 >= multiplier2:
+            ratio = multiplier1 // multiplier2
+            if amounts.size > 0 and (ratio > np.iinfo(np.int64).max or
+                                     np.abs(amounts).max() > np.iinfo(np.int64).max // ratio):
+                amounts = amounts.astype(object)
+            return amounts * ratio
+        return np.floor_divide(amounts, multiplier2 // multiplier1)
+
+    def stack_many(self, amounts: np.ndarray, denomination: str = None):
+        """ Break an array of N amounts of denomination (the lowest valued denomination by
+            default) down into an (N, number of denominations) array, stacked from the highest
+            valued denomination to the lowest, as a Wallet would be. """
+        if denomination is None:
+            denomination = self.denominations[-1]
+        remaining = self.convert_many(denomination, amounts, self.denominations[-1])
+
+        breakdown = []
+        for multiplier in self.multipliers:
+            amount, remaining = np.divmod(remaining, multiplier)
+            breakdown.append(amount)
+
+        return np.stack(breakdown, axis=-1)
+
     def json_encode(self) -> dict:
         """ Encode currency system as JSON serializable dictionary. """
         return {
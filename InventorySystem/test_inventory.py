@@ -1,8 +1,16 @@
 from unittest import TestCase
 # need InventorySystem.inventory since suite outside inventory system folder
-from InventorySystem.inventory import Item, InventorySystem, InventoryException, ItemFilter, Wallet, CurrencySystem, CurrencyException
+from InventorySystem.inventory import Item, InventorySystem, InventoryException, ItemFilter, Wallet, CurrencySystem, CurrencyException, \
+    ItemCategory, Inventory, PriceRegistry, RegistryCache, InventoryTemplate
 import numpy as np
+import copy
+import pickle
+import tempfile
+import json
+import os
 from collections import OrderedDict
+import warnings
+import InventorySystem.inventory as inventory_module
 
 
 class InventoryTest(TestCase):
@@ -125,3 +133,456 @@ class InventoryTest(TestCase):
                     self.assertEqual(i < j,  w_i.unstack() > w_j.unstack())
                     self.assertEqual(i > j,  w_i.unstack() < w_j.unstack())
                     self.assertEqual(i == j, w_i.unstack() == w_j.unstack())
+
+    def test_inventory_copy_on_write(self):
+        """ Test that adding to or removing from an inventory never changes the original. """
+        inv = InventorySystem(stack_limit=5, item_filter=ItemFilter(accept_all=True))
+        inv += Item("foo", quantity=7)
+        inv += Item("bar", quantity=2)
+        before = [(x.name, x.quantity) for x in inv.get_slots()]
+
+        added = inv + Item("foo", quantity=2)
+        removed = inv - Item("foo", quantity=6)
+
+        self.assertEqual([(x.name, x.quantity) for x in inv.get_slots()], before)
+        self.assertEqual(sum([x.quantity for x in added._contents]), 11)
+        self.assertEqual(sum([x.quantity for x in removed._contents]), 3)
+
+        # untouched stacks are shared, changed stacks are not
+        self.assertTrue(any(x is y for x in added._contents for y in inv._contents))
+        self.assertFalse(any(x is y for x in removed._contents for y in inv._contents
+                             if x.name == "Foo"))
+
+        # stacks handed out are copies, changing them does not change either page
+        added.get_contents()[0].quantity = 99
+        added.sorted_items()[0].quantity = 99
+        self.assertEqual([(x.name, x.quantity) for x in inv.get_slots()], before)
+        self.assertEqual(sum([x.quantity for x in added.get_slots()]), 11)
+
+        # failed operations leave the original intact
+        with self.assertRaises(InventoryException):
+            inv - Item("bar", quantity=3)
+        self.assertEqual([(x.name, x.quantity) for x in inv.get_slots()], before)
+
+    def test_inventory_index(self):
+        """ Test that the item index and slot counts agree with the page contents. """
+        fruit = ItemCategory("Fruit", max_slots=4)
+        items = [Item("apple", category=fruit), Item("pear", category=fruit),
+                 Item("rock"), Item("stick", max_slots=2)]
+        inv = InventorySystem(stack_limit=5, max_slots=12, item_filter=ItemFilter(accept_all=True))
+        rng = np.random.default_rng(2)
+
+        for _ in range(300):
+            it = items[rng.integers(len(items))] * int(rng.integers(1, 8))
+            try:
+                inv = inv + it if rng.integers(3) else inv - it
+            except InventoryException:
+                pass
+
+            for key, indices in inv._index.items():
+                self.assertEqual(sorted(indices),
+                                 [i for i, x in enumerate(inv._contents) if x.item_type == key])
+            self.assertEqual(len(inv._contents), sum([len(v) for v in inv._index.values()]))
+            self.assertTrue(inv._cat_slots.get(fruit, 0) <= 4)
+            self.assertTrue(inv._name_slots.get("Stick", 0) <= 2)
+            self.assertEqual(inv._name_slots.get("Apple", 0),
+                             len([x for x in inv._contents if x.name == "Apple"]))
+
+    def test_inventory_totals(self):
+        """ Test running weight and item totals against a full recount. """
+        InventorySystem.debug_totals = True
+        try:
+            ore = ItemCategory("Ore")
+            inv = InventorySystem(weight_based=True, weight_limit=500,
+                                  item_filter=ItemFilter(accept_all=True))
+            rng = np.random.default_rng(3)
+            for _ in range(200):
+                it = [Item("iron", unit_weight=3, category=ore),
+                      Item("feather", unit_weight=1)][rng.integers(2)] * int(rng.integers(1, 20))
+                try:
+                    inv = inv + it if rng.integers(3) else inv - it
+                except InventoryException:
+                    pass
+                self.assertTrue(inv.total_weight <= 500)
+
+            self.assertEqual(inv.total_weight,
+                             sum([x.unit_weight * x.quantity for x in inv.get_contents()]))
+            self.assertEqual(inv.num_items, sum([x.quantity for x in inv.get_contents()]))
+            self.assertEqual(inv.category_counts.get(ore, 0),
+                             sum([x.quantity for x in inv.get_contents() if x.category == ore]))
+        finally:
+            InventorySystem.debug_totals = False
+
+    def test_inventory_batch(self):
+        """ Test that batches are applied completely or not at all. """
+        food, tools = ItemCategory("Food"), ItemCategory("Tools")
+        inv = Inventory(pages=[InventorySystem(item_filter=f, stack_limit=10, max_slots=2)
+                               for f in ItemFilter.generate_filters([[food], [tools]])])
+        inv += [Item("bread", category=food) * 5, Item("saw", category=tools)]
+        before = str(inv)
+
+        with inv.transaction() as batch:
+            batch += Item("bread", category=food) * 3
+            batch -= Item("saw", category=tools)
+        self.assertEqual(inv.pages[0].num_items, 8)
+        self.assertEqual(inv.pages[1].num_items, 0)
+
+        inv -= Item("bread", category=food) * 3
+        inv += Item("saw", category=tools)
+        self.assertEqual(str(inv), before)
+
+        # the last add overflows the food page, so nothing is applied
+        with self.assertRaises(InventoryException):
+            inv.apply_batch(adds=[Item("saw", category=tools), Item("bread", category=food) * 20],
+                            removes=[Item("bread", category=food)])
+        self.assertEqual(str(inv), before)
+
+        with self.assertRaises(InventoryException):
+            with inv.transaction() as batch:
+                batch -= Item("saw", category=tools) * 2
+        self.assertEqual(str(inv), before)
+
+        # pages the copy did not write to are still separate page objects
+        copied = inv + Item("saw", category=tools)
+        self.assertFalse(any(page is other for page in copied.pages for other in inv.pages))
+        copied.pages[0].set_stack_limit(3)
+        self.assertEqual(inv.pages[0].num_slots(), 1)
+        self.assertEqual(copied.pages[0].num_slots(), 2)
+        copied.json_mark_clean()
+        self.assertTrue(inv.pages[0].json_is_dirty())
+
+    def test_inventory_routes(self):
+        """ Test that the routing table sends items to the same page as the page filters. """
+        food, tools, ore = ItemCategory("Food"), ItemCategory("Tools"), ItemCategory("Ore")
+        filters = ItemFilter.generate_filters([[food], [tools], [None]])
+        inv = Inventory(pages=[InventorySystem(item_filter=f) for f in filters])
+
+        for category in [food, tools, ore, None, ItemCategory("Food", stack_limit=3)]:
+            self.assertEqual(inv.route(category), inv._page_index(category))
+
+        items = [Item("bread", category=food), Item("rock", category=ore),
+                 Item("saw", category=tools), Item("apple", category=food)]
+        groups = inv.route_many(items)
+        self.assertEqual(groups[0], [items[0], items[3]])
+        self.assertEqual(sorted(groups.keys()),
+                         sorted({inv._page_index(it.category) for it in items}))
+
+        # replacing the pages recompiles the table
+        inv.pages = [InventorySystem(item_filter=ItemFilter({food: True}))]
+        self.assertEqual((inv.route(food), inv.route(tools)), (0, None))
+        inv += [Item("bread", category=food), Item("saw", category=tools)]
+        self.assertEqual(inv.pages[0].num_items, 1)
+
+        inv.pages[0] = InventorySystem(item_filter=ItemFilter({tools: True}))
+        self.assertEqual((inv.route(food), inv.route(tools)), (None, 0))
+
+        # so do pages added to the list and filters changed in place
+        gems = ItemCategory("Gems")
+        inv.pages.append(InventorySystem(item_filter=ItemFilter({gems: True})))
+        inv += Item("ruby", category=gems)
+        self.assertEqual(inv.pages[1].num_items, 1)
+        inv.pages[0].item_filter.filter_cats[food] = True
+        inv += Item("bread", category=food)
+        self.assertEqual(inv.pages[0].num_items, 1)
+
+    def test_inventory_validation(self):
+        """ Test that page overlap warnings are computed once per filter configuration. """
+        food, tools = ItemCategory("Food"), ItemCategory("Tools")
+
+        def pages():
+            return [InventorySystem(item_filter=ItemFilter({food: True, tools: True})),
+                    InventorySystem(item_filter=ItemFilter({ItemCategory("Food"): True}))]
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            Inventory(pages=pages())
+            first = [str(w.message) for w in caught]
+            self.assertIn("Multiple inventory systems accept category Food Category.", first)
+
+            signature = tuple(tuple(page.item_filter.filter_cats.items()) for page in pages())
+            self.assertIn(signature, inventory_module._validation_cache)
+
+            caught.clear()
+            Inventory(pages=pages())
+            self.assertEqual([str(w.message) for w in caught], first)
+
+            caught.clear()
+            Inventory(pages=pages(), validate=False)
+            Inventory(pages=[InventorySystem(item_filter=f) for f in
+                             ItemFilter.generate_filters([[food], [tools], [None]])])
+            self.assertEqual(caught, [])
+
+    def test_inventory_template(self):
+        """ Test that spawned inventories start equal and change independently. """
+        food, tools = ItemCategory("Food"), ItemCategory("Tools")
+        pages = [InventorySystem(item_filter=f, max_slots=4)
+                 for f in ItemFilter.generate_filters([[food], [tools]])]
+        template = InventoryTemplate(pages=pages, items=[Item("bread", category=food) * 5,
+                                                         Item("saw", category=tools)])
+        pages[0]._add_item(Item("apple", category=food))
+
+        first, second = template.spawn_many(2)
+        self.assertEqual(first, second)
+        self.assertEqual(first.pages[0].num_items, 5)
+        self.assertTrue(first.pages[0]._contents[0] is second.pages[0]._contents[0])
+
+        first += Item("bread", category=food) * 2
+        first.pages[1]._add_item(Item("hammer", category=tools))
+        self.assertEqual((first.pages[0].num_items, first.pages[1].num_items), (7, 2))
+        self.assertEqual((second.pages[0].num_items, second.pages[1].num_items), (5, 1))
+        self.assertEqual(template.spawn(), second)
+
+    def test_render_cache(self):
+        """ Test that page strings are cached until the page changes. """
+        food = ItemCategory("Food")
+        inv = InventorySystem(stack_limit=5, item_filter=ItemFilter(accept_all=True))
+        inv += [Item("pear", category=food) * 7, Item("apple", price=2), Item("fig") * 3]
+
+        text = str(inv)
+        self.assertTrue(str(inv) is text)
+        # rows are formatted once per item and quantity
+        self.assertTrue(Item("pear", category=food, quantity=5)._row() is
+                        inv.get_contents()[0]._row())
+
+        inv += Item("apple", price=2)
+        self.assertNotEqual(str(inv), text)
+        inv -= Item("apple", price=2)
+        self.assertEqual(str(inv), text)
+
+        # copies share the cached string until either is written to
+        text = str(inv)
+        inv_copy = inv + Item("fig")
+        self.assertTrue(str(inv) is text)
+        self.assertNotEqual(str(inv_copy), text)
+        self.assertEqual(str(inv_copy), str(InventorySystem(
+            stack_limit=5, item_filter=ItemFilter(accept_all=True)) + [
+            Item("pear", category=food) * 7, Item("apple", price=2), Item("fig") * 4]))
+
+    def test_sorted_queries(self):
+        """ Test the sorted queries against sorting the contents, while the page changes. """
+        food, tools = ItemCategory("Food"), ItemCategory("Tools")
+        inv = InventorySystem(stack_limit=4, item_filter=ItemFilter(accept_all=True))
+        items = [Item("item " + str(i), category=[food, tools, None][i % 3], price=i % 5 + 1,
+                      unit_weight=i % 4 + 1) for i in range(12)]
+
+        def value(it):
+            return it.price.unstack() * it.quantity
+
+        for step in range(200):
+            it = items[(step * 7) % len(items)] * (step % 6 + 1)
+            try:
+                inv = inv - it if step % 3 == 0 else inv + it
+            except InventoryException:
+                pass
+            if step % 10 == 0:
+                slots = inv.get_slots()
+                self.assertEqual(inv.sorted_items("name"), sorted(slots, key=lambda x: x.name))
+                self.assertEqual([value(x) for x in inv.top_n_by_value(5)],
+                                 sorted([value(x) for x in slots], reverse=True)[:5])
+                self.assertEqual([x.unit_weight * x.quantity for x in inv.heaviest(3)],
+                                 sorted([x.unit_weight * x.quantity for x in slots],
+                                        reverse=True)[:3])
+                for category in [food, tools, None]:
+                    in_category = inv.items_in_category(category)
+                    self.assertEqual(sorted([(x.name, x.quantity) for x in in_category]),
+                                     sorted([(x.name, x.quantity) for x in slots
+                                             if x.category == category]))
+                    self.assertEqual([value(x) for x in in_category],
+                                     sorted([value(x) for x in in_category], reverse=True))
+                # queries never reorder the slots
+                self.assertEqual(inv.get_slots(), slots)
+
+        filters = ItemFilter.generate_filters([[food], [tools, None]])
+        multi = Inventory(pages=[InventorySystem(item_filter=f) for f in filters]) + items
+        self.assertEqual([value(x) for x in multi.top_n_by_value(3)], [5, 5, 4])
+        self.assertEqual([x.unit_weight for x in multi.heaviest(2)], [4, 4])
+        self.assertEqual(len(multi.items_in_category(tools)), 4)
+        with self.assertRaises(InventoryException):
+            inv.sorted_items("colour")
+
+    def test_item_type(self):
+        """ Test that item definitions are shared between stacks of the same item. """
+        foo = Item("foo bar", quantity=3, price=7, unit_weight=2)
+        other = Item("Foo Bar", quantity=5, price=7, unit_weight=2)
+
+        self.assertTrue(foo.item_type is other.item_type)
+        self.assertTrue((foo * 4).item_type is foo.item_type)
+        self.assertFalse(hasattr(foo, "__dict__"))
+        self.assertEqual(foo, other)
+        self.assertNotEqual(foo, Item("foo bar", price=8, unit_weight=2))
+
+        changed = foo.copy(unit_weight=3)
+        self.assertEqual((changed.quantity, changed.unit_weight, changed.name), (3, 3, "Foo Bar"))
+
+        copied = copy.deepcopy(foo)
+        self.assertTrue(copied.item_type is foo.item_type)
+        self.assertEqual(copied.quantity, 3)
+
+        decoded = Item.json_decode(foo.json_encode())
+        self.assertTrue(decoded.item_type is foo.item_type)
+        self.assertEqual(pickle.loads(pickle.dumps(foo)).item_type.key, foo.item_type.key)
+
+        # changing the wallet an item was made with does not change the shared type
+        price = Wallet(amount=5)
+        gem = Item("gem", price=price)
+        price.add_currency("Gold", 100)
+        self.assertEqual(gem.price.unstack(), 5)
+        self.assertEqual(Item("gem", price=Wallet(amount=5)).price.unstack(), 5)
+
+        # nor does changing the price an item hands out
+        other_gem = Item("gem", price=5)
+        gem.price.add_currency("Gold", 10)
+        self.assertEqual((gem.price.unstack(), other_gem.price.unstack()), (5, 5))
+        self.assertEqual(gem, Item("gem", price=5))
+        self.assertNotEqual(gem, Item("gem", price=15))
+        self.assertEqual(gem.unit_price, 5)
+
+    def test_item_hash(self):
+        """ Test that equal items hash equally and can be used in sets and dicts. """
+        gold = CurrencySystem(OrderedDict({"Gold": 1, "Silver": 10}))
+        price = Wallet(curr_sys=gold)
+        price.add_currency("Silver", 2)
+
+        # same value (in lowest denomination) in another currency system is the same item
+        items = [Item("gem", quantity=q, price=p) for q in range(1, 4) for p in [2, price]]
+        self.assertEqual(len(set(items)), 1)
+        self.assertEqual(len({Item("gem"), Item("gem", price=2), Item("rock")}), 3)
+        self.assertEqual({Item("gem", price=2): "found"}.get(Item("gem", quantity=9, price=2)),
+                         "found")
+        self.assertNotEqual(Item("gem", price=2), None)
+        self.assertNotEqual(Item("gem"), Item("gem", price=2))
+
+    def test_wallet_breakdown(self):
+        """ Test that a wallet's breakdown into denominations matches its balance. """
+        curr_sys = CurrencySystem(OrderedDict({"Gold": 1, "Silver": 7, "Copper": 13}))
+        self.assertEqual(curr_sys.multipliers, [91, 13, 1])
+
+        for amount in range(0, 500, 7):
+            wallet = Wallet(curr_sys=curr_sys, amount=amount)
+            breakdown = wallet.wallet
+            self.assertEqual(list(breakdown.values()),
+                             [amount // 91, (amount % 91) // 13, amount % 13])
+            self.assertEqual(wallet.unstack(wallet=breakdown), amount)
+            self.assertEqual(curr_sys.convert("Copper", amount, "Silver", whole_number=True),
+                             amount // 13)
+            self.assertEqual(curr_sys.convert("Gold", amount, "Copper"), amount * 91)
+
+        wallet = Wallet(curr_sys=curr_sys)
+        self.assertTrue(wallet.add_currency("Gold", 2))
+        self.assertFalse(wallet.add_currency("Platinum", 2))
+        self.assertTrue(wallet.add_currency("Copper", -1))
+        self.assertEqual(list(wallet.wallet.values()), [1, 6, 12])
+        with self.assertRaises(CurrencyException):
+            wallet.add_currency("Gold", -3)
+
+    def test_currency_bulk(self):
+        """ Test bulk conversions against single conversions. """
+        curr_sys = CurrencySystem(OrderedDict({"Gold": 1, "Silver": 7, "Copper": 13, "Bit": 4}))
+        amounts = np.random.default_rng(8).integers(0, 10 ** 6, size=200)
+
+        for d1 in curr_sys.denominations:
+            for d2 in curr_sys.denominations:
+                bulk = curr_sys.convert_many(d1, amounts, d2)
+                self.assertEqual(bulk.tolist(), [curr_sys.convert(d1, int(a), d2, whole_number=True)
+                                                 for a in amounts])
+                floats = amounts / 3
+                self.assertEqual(curr_sys.convert_many(d1, floats, d2).tolist(),
+                                 [curr_sys.convert(d1, float(a), d2, whole_number=True)
+                                  for a in floats])
+
+        breakdown = curr_sys.stack_many(amounts)
+        self.assertEqual(breakdown.shape, (200, 4))
+        self.assertEqual(breakdown.tolist(),
+                         [list(Wallet(curr_sys=curr_sys, amount=int(a)).wallet.values())
+                          for a in amounts])
+        self.assertEqual(curr_sys.stack_many([3], denomination="Gold").tolist(), [[3, 0, 0, 0]])
+        self.assertEqual(curr_sys.convert_many("Gold", [2 ** 62], "Bit").tolist(),
+                         [2 ** 62 * 364])
+
+    def test_price_registry_index(self):
+        """ Test the sqlite backed price registry against the dictionary backed one. """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            registry_path = os.path.join(tmp_dir, "Registry.json")
+            with open(registry_path, 'w') as registry_file:
+                json.dump({"Item " + str(i): i for i in range(2000)}, registry_file)
+
+            in_memory = PriceRegistry(read_file_path=registry_path)
+            indexed = PriceRegistry(read_file_path=registry_path, storage="sqlite")
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "Registry.sqlite")))
+            self.assertEqual(in_memory, indexed)
+
+            names = ["Item 5", "Item 1999", "Missing"]
+            self.assertEqual(indexed.read_many(names), in_memory.read_many(names))
+            self.assertEqual(indexed.read_many(names), {"Item 5": 5, "Item 1999": 1999,
+                                                        "Missing": None})
+
+            indexed.add_to_registry("Sword", 40)
+            indexed.close()
+
+            # reopening uses the index without rewriting or re-reading the registry file
+            reopened = PriceRegistry(read_file_path=registry_path, storage="sqlite")
+            self.assertEqual(reopened.read_from_registry("Sword"), 40)
+            self.assertEqual(reopened.read_from_registry("Item 7"), 7)
+            self.assertIsNone(reopened.read_file)
+            reopened.close()
+            with open(registry_path) as registry_file:
+                self.assertNotIn("Sword", json.load(registry_file))
+
+            # rebuilding the index from a newer file keeps the added entries
+            with open(registry_path, 'w') as registry_file:
+                json.dump({"Item 7": 70, "Shield": 12}, registry_file)
+            os.utime(registry_path, (os.path.getmtime(registry_path) + 10,) * 2)
+            rebuilt = PriceRegistry(read_file_path=registry_path, storage="sqlite")
+            self.assertEqual(rebuilt.read_many(["Item 7", "Item 8", "Shield", "Sword"]),
+                             {"Item 7": 70, "Item 8": None, "Shield": 12, "Sword": 40})
+            rebuilt.close()
+
+            # a corrupted file leaves the index as it was
+            with open(registry_path, 'w') as registry_file:
+                registry_file.write("{corrupted")
+            os.utime(registry_path, (os.path.getmtime(registry_path) + 20,) * 2)
+            with warnings.catch_warnings(record=True):
+                warnings.simplefilter("always")
+                kept = PriceRegistry(read_file_path=registry_path, storage="sqlite")
+            self.assertEqual(kept.read_many(["Item 7", "Sword"]), {"Item 7": 70, "Sword": 40})
+            kept.close()
+
+    def test_registry_cache(self):
+        """ Test that cached registries are shared, reloaded on change and evicted. """
+        cache = RegistryCache(max_entries=2)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, f"Registry{i}.json") for i in range(3)]
+            for i, path in enumerate(paths):
+                with open(path, 'w') as registry_file:
+                    json.dump({"Foo": i}, registry_file)
+
+            first = cache.get(paths[0])
+            self.assertTrue(cache.get(paths[0]) is first)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            with self.assertRaises(InventoryException):
+                first.add_to_registry("Bar", 3)
+
+            with open(paths[0], 'w') as registry_file:
+                json.dump({"Foo": 10, "Bar": 3}, registry_file)
+            os.utime(paths[0], ns=(0, 0))
+
+            reloaded = cache.get(paths[0])
+            self.assertFalse(reloaded is first)
+            self.assertEqual(reloaded.read_from_registry("Bar"), 3)
+            self.assertEqual(cache.reloads, 1)
+
+            cache.get(paths[1])
+            cache.get(paths[2])
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.evictions, 1)
+            self.assertEqual(cache.stats()["misses"], 3)
+
+            # registries handed out stay usable after they leave the cache
+            cache = RegistryCache(max_entries=1)
+            shopkeeper = cache.get(paths[0], storage="sqlite")
+            cache.get(paths[1], storage="sqlite")
+            self.assertEqual(cache.evictions, 1)
+            self.assertEqual(shopkeeper.read_from_registry("Foo"), 10)
+            cache.clear()
+            self.assertEqual(shopkeeper.read_from_registry("Bar"), 3)
+            shopkeeper.close()
@@ -1,4 +1,39 @@
-from random import shuffle
+from random import Random
+from collections import OrderedDict
+import numpy as np
+import os
+import tempfile
+import struct
+
+
+# map file: header, palette table, then the raw tile ids row by row (little endian).
+# header: magic, version, bytes per tile, width, height, palette entries, tile offset.
+MAP_FILE_MAGIC = b"GTMAP"
+MAP_FILE_VERSION = 1
+MAP_FILE_HEADER = struct.Struct("<5sBBxIIII")
+# tiles start at a multiple of this many bytes.
+MAP_FILE_ALIGN = 64
+
+# chunk store of a ChunkedMap: header, the chunks, then the palette table (rewritten on flush).
+# header: magic, version, bytes per tile, width, height, chunk size, palette entries,
+# palette offset.
+CHUNK_FILE_MAGIC = b"GTCHK"
+CHUNK_FILE_VERSION = 1
+CHUNK_FILE_HEADER = struct.Struct("<5sBBxIIIIQ")
+
+
+def _read_palette(fp, num_blocks: int):
+    """ Read a palette table written by Map._pack_palette, as (key, character, walkable). """
+    def unpack_str():
+        length, = struct.unpack("<H", fp.read(2))
+        return fp.read(length).decode("utf-8")
+
+    palette = []
+    for _ in range(num_blocks):
+        block, character = unpack_str(), unpack_str()
+        walkable, = struct.unpack("<?", fp.read(1))
+        palette.append((block, character, walkable))
+    return palette
 
 
 class MapException(Exception):
@@ -13,16 +48,94 @@ class MapException(Exception):
         self.map_obj = map_obj
 
 
+class TileRowView:
+    """ A row of a map's tiles, read and written as character keys. """
+    def __init__(self, map_obj, row: int):
+        """ View of a single row of map_obj's tiles. """
+        self.map_obj = map_obj
+        self.row = row
+
+    def __len__(self):
+        """ Width of the row. """
+        return self.map_obj.width
+
+    def __iter__(self):
+        """ Iterate over the character keys of the row. """
+        return iter(self[:])
+
+    def _columns(self, col):
+        """ Array of the column indices of a column index or slice. """
+        if isinstance(col, slice):
+            return np.arange(*col.indices(len(self)))
+        if col < 0:
+            col += len(self)
+        if not 0 <= col < len(self):
+            raise IndexError("map column out of range")
+        return np.array([col])
+
+    def __getitem__(self, col):
+        """ Character key of a cell, or a list of keys for a slice. """
+        cols = self._columns(col)
+        if len(cols) == 0:
+            return []
+        tiles = self.map_obj.read_region(int(cols.min()), self.row,
+                                         int(cols.max() - cols.min()) + 1, 1)[0]
+        keys = [self.map_obj.palette[tile] for tile in tiles[cols - cols.min()].tolist()]
+        return keys if isinstance(col, slice) else keys[0]
+
+    def __setitem__(self, col, character_key):
+        """ Set a cell (or a slice of cells) to a character key, or a slice of cells to a
+            sequence of keys of the same length. """
+        cols = self._columns(col)
+        if isinstance(character_key, str):
+            self.map_obj.write_cells(cols, np.full(len(cols), self.row),
+                                     self.map_obj.tile_id(character_key))
+            return
+
+        tiles = np.array([self.map_obj.tile_id(key) for key in character_key], dtype=np.int64)
+        if len(tiles) != len(cols):
+            raise ValueError(f"cannot assign {len(tiles)} map cells to {len(cols)} cells")
+        for tile in np.unique(tiles).tolist():
+            same = tiles == tile
+            self.map_obj.write_cells(cols[same], np.full(int(same.sum()), self.row), tile)
+
+
+class TileView:
+    """ A map's tiles read and written as rows of character keys, map[y][x]. """
+    def __init__(self, map_obj):
+        """ View of all of map_obj's tiles. """
+        self.map_obj = map_obj
+
+    def __len__(self):
+        """ Height of the map. """
+        return self.map_obj.height
+
+    def __iter__(self):
+        """ Iterate over the rows. """
+        return iter([TileRowView(self.map_obj, row) for row in range(len(self))])
+
+    def __getitem__(self, row):
+        """ View of a single row. """
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("map row out of range")
+        return TileRowView(self.map_obj, row)
+
+    def __setitem__(self, row, character_keys):
+        """ Set a whole row to a sequence of character keys (one per column). """
+        self[row][:] = character_keys
+
+
 class Map:
-    """ General Map type object. Contains default cell type if not specified. """
+    """ General Map type object. Contains default cell type if not specified.
+        Tiles are stored as an array of ids into the palette of character keys. """
     def __init__(self, width, height, *args):
         """ Generate a generic map of particular width and height. """
         self.width = width
         self.height = height
         self.dims = (width, height)
         self.args = args
-        self.map = [[args[0] if len(args) > 0 else "default"
-                     for _ in range(width)] for __ in range(height)]
 
         self.MAP_CHARS = {
             "default": "??",
@@ -36,13 +149,66 @@ class Map:
             "WALL": False
         }
 
+        # tile id -> character key, in the order keys are declared.
+        self.palette = list(self.MAP_CHARS.keys())
+        self._tile_ids = {block: i for i, block in enumerate(self.palette)}
+
+        self.tile_dtype = np.uint8
+        self._create_tiles(self.tile_id(args[0] if len(args) > 0 else "default"))
+
+    def _create_tiles(self, tile):
+        """ Create the tile store, with every cell set to a tile id. """
+        self.tiles = np.full((self.height, self.width), tile, dtype=self.tile_dtype)
+
+    def _widen_tiles(self, dtype):
+        """ Convert the tile store to a wider integer type, for a larger palette. """
+        self.tiles = self.tiles.astype(dtype)
+        self.tile_dtype = dtype
+
+    @property
+    def map(self):
+        """ The tiles as rows of character keys, map[y][x]. """
+        return TileView(self)
+
+    @map.setter
+    def map(self, rows):
+        """ Set the tiles from rows of character keys. """
+        self.tiles = np.array([[self.tile_id(block) for block in row] for row in rows],
+                              dtype=self.tile_dtype).reshape(len(rows), -1)
+        self.height, self.width = self.tiles.shape
+        self.dims = (self.width, self.height)
+
+    def tile_id(self, character_key):
+        """ Return the tile id of a character key. """
+        tile = self._tile_ids.get(character_key, None)
+        if tile is None:
+            raise MapException(self, msg=f"Character key non-existent: {character_key}")
+        return tile
+
     def __str__(self):
         """ Draw the map. """
-        return "\n".join(
-            ["".join(
-                [self.MAP_CHARS[x] for x in line]
-            ) for line in self.map]
-        )
+        return "\n".join(self.region_to_strings(0, 0, self.width, self.height))
+
+    def region_to_strings(self, x_location, y_location, w, h):
+        """ Draw a region of the map as one string per row, clipped to the map. """
+        clipped = self._clip(x_location, y_location, w, h)
+        if clipped is None:
+            return []
+        x0, y0, x1, y1 = clipped
+        chars = np.array([self.MAP_CHARS[block] for block in self.palette], dtype=object)
+        return ["".join(line) for line in
+                chars[self.read_region(x0, y0, x1 - x0, y1 - y0)].tolist()]
+
+    def walkable_region(self, x_location, y_location, w, h):
+        """ Boolean array of which cells of a region (within the map) are walkable,
+            indexed [y][x]. """
+        walkable = np.array([self.is_walkable(block) for block in self.palette], dtype=bool)
+        return walkable[self.read_region(x_location, y_location, w, h)]
+
+    def prefetch(self, x_location, y_location, radius):
+        """ Hint that the cells within radius of a location will be used soon.
+            All tiles of a Map are in memory, so this does nothing. """
+        pass
 
     def array_to_string(self, line):
         """ Convert a list to a line of block characters. """
@@ -52,10 +218,16 @@ class Map:
         """ Declare a new entry of the map character dictionary. """
         if block in self.MAP_CHARS.keys():
             raise MapException(None, msg="Re-declaring existing map character key")
+        # widen first, so a map that cannot hold another key is left unchanged.
+        if len(self.palette) + 1 > np.iinfo(self.tile_dtype).max + 1:
+            self._widen_tiles(np.uint16)
 
         self.MAP_CHARS[block] = character
         self.WALKABLE[block] = walkable
 
+        self._tile_ids[block] = len(self.palette)
+        self.palette.append(block)
+
     def set_map_char_block(self, block: str = "", character: str = "#"):
         """ Set entry of the map character dictionary. """
         if block not in self.MAP_CHARS.keys():
@@ -63,113 +235,512 @@ class Map:
 
         self.MAP_CHARS[block] = character
 
+    def read_region(self, x_location, y_location, w, h):
+        """ Return the tile ids of a region, which must lie within the map. The result
+            may be a view of the map, so it should not be written to. """
+        return self.tiles[y_location:y_location + h, x_location:x_location + w]
+
+    def write_region(self, x_location, y_location, tiles, mask=None):
+        """ Write an array of tile ids to a region within the map, only
+            where mask (of the same shape) is true if given. """
+        region = self.tiles[y_location:y_location + tiles.shape[0],
+                            x_location:x_location + tiles.shape[1]]
+        if mask is None:
+            region[...] = tiles
+        else:
+            region[mask] = tiles[mask]
+
+    def write_cells(self, xs, ys, tile):
+        """ Write a tile id to the cells at x and y locations (or arrays of them)
+            within the map. """
+        self.tiles[ys, xs] = tile
+
+    def _clip(self, x_location, y_location, w, h):
+        """ Clip a region to the map, returning its corners (x0, y0, x1, y1),
+            or None if nothing is left. """
+        x0, y0 = max(x_location, 0), max(y_location, 0)
+        x1, y1 = min(x_location + w, self.width), min(y_location + h, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return x0, y0, x1, y1
+
     def draw_rect_to_map(self, character, x_location, y_location, w, h):
         """ Draw a rectangle to the map, using a specific character. """
-        for i in range(x_location, x_location + w):
-            self.draw_to_map(character, i, y_location)
-            self.draw_to_map(character, i, y_location + h - 1)
-        for i in range(y_location, y_location + h):
-            self.draw_to_map(character, x_location, i)
-            self.draw_to_map(character, x_location + w - 1, i)
+        self.fill_rect_to_map(character, x_location, y_location, w, 1)
+        self.fill_rect_to_map(character, x_location, y_location + h - 1, w, 1)
+        self.fill_rect_to_map(character, x_location, y_location, 1, h)
+        self.fill_rect_to_map(character, x_location + w - 1, y_location, 1, h)
 
     def fill_rect_to_map(self, character, x_location, y_location, w, h):
-        """ Fill a rectangle to the map, using a specific character. """
-        for i in range(x_location, x_location + w):
-            for j in range(y_location, y_location + h):
-                self.draw_to_map(character, i, j)
+        """ Fill a rectangle to the map, using a specific character.
+            Parts of the rectangle outside of the map are left out. """
+        tile = self.tile_id(character)
+        clipped = self._clip(x_location, y_location, w, h)
+        if clipped is None:
+            return
+        x0, y0, x1, y1 = clipped
+        self.write_region(x0, y0, np.broadcast_to(np.asarray(tile, dtype=self.tile_dtype),
+                                                  (y1 - y0, x1 - x0)))
+
+    def draw_line_to_map(self, character, x1, y1, x2, y2):
+        """ Draw a line between two cells (inclusive), using a specific character.
+            Parts of the line outside of the map are left out. """
+        tile = self.tile_id(character)
+        num_cells = max(abs(x2 - x1), abs(y2 - y1)) + 1
+        xs = np.rint(np.linspace(x1, x2, num_cells)).astype(np.int64)
+        ys = np.rint(np.linspace(y1, y2, num_cells)).astype(np.int64)
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        self.write_cells(xs[inside], ys[inside], tile)
+
+    def draw_circle_to_map(self, character, x_center, y_center, radius, fill=False):
+        """ Draw a circle (or a disc if fill is true) around a cell, using a specific
+            character. Parts of the circle outside of the map are left out. """
+        tile = self.tile_id(character)
+        clipped = self._clip(x_center - radius, y_center - radius, 2 * radius + 1, 2 * radius + 1)
+        if clipped is None:
+            return
+        x0, y0, x1, y1 = clipped
+
+        dy, dx = np.ogrid[y0 - y_center:y1 - y_center, x0 - x_center:x1 - x_center]
+        distance = dx * dx + dy * dy
+        mask = distance <= (radius + 0.5) ** 2
+        if not fill and radius > 0:
+            mask &= distance >= (radius - 0.5) ** 2
+
+        self.write_region(x0, y0, np.broadcast_to(np.asarray(tile, dtype=self.tile_dtype),
+                                                  mask.shape), mask=mask)
+
+    def flood_fill_to_map(self, character, x_location, y_location, bounds=None):
+        """ Fill the area of cells of the same kind as the cell at the location (connected
+            horizontally and vertically) with a specific character. The fill works on runs
+            of cells within a row, and stays within bounds (x, y, w, h) if given. """
+        tile = self.tile_id(character)
+        clipped = self._clip(*(bounds if bounds is not None else (0, 0, self.width, self.height)))
+        if clipped is None:
+            return
+        x0, y0, x1, y1 = clipped
+        if not (x0 <= x_location < x1 and y0 <= y_location < y1):
+            raise MapException(self, msg="Flood fill started outside of the map")
+
+        region = self.read_region(x0, y0, x1 - x0, y1 - y0)
+        same = region == region[y_location - y0, x_location - x0]
+        filled = np.zeros(same.shape, dtype=bool)
+
+        # row -> (starts, ends) of the runs of cells of the same kind in that row
+        runs = {}
+
+        def row_runs(row):
+            if row not in runs:
+                edges = np.diff(np.concatenate(([0], same[row].view(np.int8), [0])))
+                runs[row] = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+            return runs[row]
+
+        starts, ends = row_runs(y_location - y0)
+        stack = [(y_location - y0, int(np.searchsorted(ends, x_location - x0, side='right')))]
+        visited = set()
+        while len(stack) > 0:
+            row, run = stack.pop()
+            if (row, run) in visited:
+                continue
+            visited.add((row, run))
+
+            start, end = runs[row][0][run], runs[row][1][run]
+            filled[row, start:end] = True
+
+            for next_row in [row - 1, row + 1]:
+                if 0 <= next_row < same.shape[0]:
+                    # runs of the next row overlapping this run
+                    starts, ends = row_runs(next_row)
+                    first = np.searchsorted(ends, start, side='right')
+                    last = np.searchsorted(starts, end, side='left')
+                    stack += [(next_row, i) for i in range(first, last)]
+
+        self.write_region(x0, y0, np.broadcast_to(np.asarray(tile, dtype=self.tile_dtype),
+                                                  filled.shape), mask=filled)
 
     def draw_to_map(self, character_key, x_location, y_location):
-        """ Draw a cell to the map, using a specific character. """
-        if list(self.MAP_CHARS.keys()).index(character_key) != -1:
-            # character is in the MAP_CHARS area
-            # map_obj -> Map
-            # map_obj.map -> list[list[int]]
-
-            self.map[y_location][x_location] = character_key
-
-    def draw_sub_map(self, sub_map, x_location, y_location):
-        """ Draw a portion or all of a sub-map to the map. """
-        for row in range(len(sub_map.map)):
-            for col in range(len(sub_map.map[row])):
-                try:
-                    self.map[x_location+col][y_location+row] = sub_map.map[col][row]
-                except IndexError:
-                    # just continue off
-                    pass
+        """ Draw a cell to the map, using a specific character.
+            Raises a MapException if the character key is not declared. """
+        self.write_cells(x_location, y_location, self.tile_id(character_key))
+
+    def draw_sub_map(self, sub_map, x_location, y_location, transparent=None):
+        """ Draw a portion or all of a sub-map to the map, with its top left corner at the
+            location. Parts outside of the map are left out, and cells of the sub-map with
+            the transparent character key (if given) leave the map unchanged. """
+        clipped = self._clip(x_location, y_location, sub_map.width, sub_map.height)
+        if clipped is None:
+            return
+        x0, y0, x1, y1 = clipped
+
+        # sub-map tile id -> tile id of the same character key in this map
+        translate = np.array([self._tile_ids.get(block, -1) for block in sub_map.palette],
+                             dtype=np.int64)
+        tiles = sub_map.read_region(x0 - x_location, y0 - y_location, x1 - x0, y1 - y0)
+        mask = None
+        if transparent is not None:
+            mask = tiles != sub_map.tile_id(transparent)
+        tiles = translate[tiles]
+        if np.any((tiles if mask is None else tiles[mask]) < 0):
+            raise MapException(self, msg="Sub-map uses a character key non-existent in map")
+        self.write_region(x0, y0, tiles.astype(self.tile_dtype), mask=mask)
 
     def is_walkable(self, block):
         """ Return if the map deems a particular block type to be walkable. """
         return self.WALKABLE.get(block, False)
 
+    def _pack_palette(self) -> bytes:
+        """ Palette table of a map file: each key with its character and walkability. """
+        def pack_str(text):
+            encoded = text.encode("utf-8")
+            return struct.pack("<H", len(encoded)) + encoded
+
+        return b"".join([pack_str(block) + pack_str(self.MAP_CHARS[block]) +
+                         struct.pack("<?", self.is_walkable(block)) for block in self.palette])
+
+    def _set_palette(self, palette):
+        """ Replace the palette with (key, character, walkable) entries, in tile id order. """
+        self.MAP_CHARS = {block: character for block, character, _ in palette}
+        self.WALKABLE = {block: walkable for block, _, walkable in palette}
+        self.palette = [block for block, _, _ in palette]
+        self._tile_ids = {block: i for i, block in enumerate(self.palette)}
+
+    def save(self, path: str, rows_per_write: int = 1024):
+        """ Save the map to a map file (see Map.open), a header and palette table
+            followed by the raw tile ids. Tiles are read a band of rows at a time. """
+        palette = self._pack_palette()
+        offset = MAP_FILE_HEADER.size + len(palette)
+        offset += -offset % MAP_FILE_ALIGN
+        dtype = np.dtype(self.tile_dtype).newbyteorder("<")
+
+        with open(path, 'wb') as fp:
+            fp.write(MAP_FILE_HEADER.pack(MAP_FILE_MAGIC, MAP_FILE_VERSION, dtype.itemsize,
+                                          self.width, self.height, len(self.palette), offset))
+            fp.write(palette)
+            fp.write(b"\0" * (offset - MAP_FILE_HEADER.size - len(palette)))
+            for row in range(0, self.height, rows_per_write):
+                band = self.read_region(0, row, self.width, min(rows_per_write, self.height - row))
+                fp.write(band.astype(dtype).tobytes())
+
+    @staticmethod
+    def open(path: str, mode: str = 'r'):
+        """ Open a map file written by save. The tiles are memory-mapped rather than read,
+            so opening takes the same time for any map size and only the parts of the map
+            that are used are loaded. mode is the np.memmap mode: 'r' (read-only), 'r+'
+            (changes are written to the file) or 'c' (changes are kept in memory). """
+        with open(path, 'rb') as fp:
+            header = fp.read(MAP_FILE_HEADER.size)
+            if (len(header) != MAP_FILE_HEADER.size or
+                    header[:len(MAP_FILE_MAGIC)] != MAP_FILE_MAGIC):
+                raise MapException(None, msg=f"Not a map file: {path}")
+            (magic, version, itemsize, width, height, num_blocks,
+             offset) = MAP_FILE_HEADER.unpack(header)
+            if version != MAP_FILE_VERSION or itemsize not in [1, 2]:
+                raise MapException(None, msg=f"Unsupported map file version: {path}")
+            palette = _read_palette(fp, num_blocks)
+
+        # no tile array is allocated, so Map.__init__ is not used.
+        map_obj = Map.__new__(Map)
+        map_obj.width, map_obj.height = width, height
+        map_obj.dims = (width, height)
+        map_obj.args = ()
+        map_obj._set_palette(palette)
+        map_obj.tile_dtype = np.dtype("<u" + str(itemsize))
+        map_obj.tiles = np.memmap(path, dtype=map_obj.tile_dtype, mode=mode, offset=offset,
+                                  shape=(height, width))
+        return map_obj
+
+
+class ChunkedMap(Map):
+    """ Map whose tiles are kept in a file of fixed size square chunks, of which only the
+        most recently used chunks are held in memory. Changed chunks are written back to
+        the file when they leave memory or when the map is flushed. """
+    def __init__(self, width, height, *args, chunk_size: int = 64, max_resident: int = 64,
+                 path: str = None):
+        """ Generate a chunked map of particular width and height. The chunks are stored
+            at path (a temporary file by default, removed on close). If path holds the
+            chunk store of a map of the same size and chunk size, its tiles and palette
+            are used; any other existing file raises a MapException. """
+        self.chunk_size = chunk_size
+        self.max_resident = max(1, max_resident)
+        self.path = path
+
+        # (chunk x, chunk y) -> tiles of the resident chunks, least recently used first.
+        self._chunks = OrderedDict()
+        self._dirty = set()
+
+        # numbers of chunks read from the store and evicted from memory.
+        self.loads = 0
+        self.evictions = 0
+
+        super().__init__(width, height, *args)
+
+    def _create_tiles(self, tile):
+        """ Open (or create) the chunk store. """
+        self.chunks_x = -(-self.width // self.chunk_size)
+        self.chunks_y = -(-self.height // self.chunk_size)
+        shape = (self.chunks_y, self.chunks_x, self.chunk_size, self.chunk_size)
+        itemsize = np.dtype(self.tile_dtype).itemsize
+        self._offset = CHUNK_FILE_HEADER.size + (-CHUNK_FILE_HEADER.size % MAP_FILE_ALIGN)
+        self._palette_offset = self._offset + int(np.prod(shape)) * itemsize
+
+        self._owns_file = self.path is None
+        if self.path is None:
+            fd, self.path = tempfile.mkstemp(suffix=".chunks")
+            os.close(fd)
+        existing = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        if existing:
+            self._read_store_header(itemsize)
+        else:
+            # sparse file, chunks never written are filled with the default tile when loaded.
+            with open(self.path, 'wb') as fp:
+                fp.truncate(self._palette_offset)
+            self._write_palette()
+
+        self._store = np.memmap(self.path, dtype=self.tile_dtype, mode='r+',
+                                offset=self._offset, shape=shape)
+        self._written = np.full((self.chunks_y, self.chunks_x), existing, dtype=bool)
+        self._fill = tile
+
+    def _read_store_header(self, itemsize: int):
+        """ Check an existing chunk store matches this map, and use its palette. """
+        with open(self.path, 'rb') as fp:
+            header = fp.read(CHUNK_FILE_HEADER.size)
+            if (len(header) != CHUNK_FILE_HEADER.size or
+                    header[:len(CHUNK_FILE_MAGIC)] != CHUNK_FILE_MAGIC):
+                raise MapException(self, msg=f"Not a chunk store: {self.path}")
+            (magic, version, stored_itemsize, width, height, chunk_size, num_blocks,
+             palette_offset) = CHUNK_FILE_HEADER.unpack(header)
+            if (version != CHUNK_FILE_VERSION or stored_itemsize != itemsize or
+                    (width, height, chunk_size) != (self.width, self.height, self.chunk_size) or
+                    palette_offset != self._palette_offset):
+                raise MapException(self, msg=f"Chunk store of a different map: {self.path}")
+            fp.seek(palette_offset)
+            self._set_palette(_read_palette(fp, num_blocks))
+
+    def _write_palette(self):
+        """ Write the header and palette table of the chunk store. """
+        with open(self.path, 'r+b') as fp:
+            fp.write(CHUNK_FILE_HEADER.pack(
+                CHUNK_FILE_MAGIC, CHUNK_FILE_VERSION, np.dtype(self.tile_dtype).itemsize,
+                self.width, self.height, self.chunk_size, len(self.palette),
+                self._palette_offset))
+            fp.seek(self._palette_offset)
+            fp.write(self._pack_palette())
+            fp.truncate()
+
+    def _widen_tiles(self, dtype):
+        """ The chunk store has a fixed tile size. """
+        raise MapException(self, msg="Chunked map palette is full")
+
+    @Map.map.setter
+    def map(self, rows):
+        """ Set the tiles from rows of character keys, which must match the map's size. """
+        tiles = np.array([[self.tile_id(block) for block in row] for row in rows],
+                         dtype=self.tile_dtype).reshape(len(rows), -1)
+        if tiles.shape != (self.height, self.width):
+            raise MapException(self, msg="Cannot resize a chunked map")
+        self.write_region(0, 0, tiles)
+
+    def _chunk(self, chunk_x, chunk_y):
+        """ Return the tiles of a chunk, loading it (and evicting the least recently
+            used chunk if too many are resident) if needed. """
+        key = (chunk_x, chunk_y)
+        chunk = self._chunks.get(key, None)
+        if chunk is not None:
+            self._chunks.move_to_end(key)
+            return chunk
+
+        if self._written[chunk_y, chunk_x]:
+            chunk = np.array(self._store[chunk_y, chunk_x])
+        else:
+            chunk = np.full((self.chunk_size, self.chunk_size), self._fill, dtype=self.tile_dtype)
+        self.loads += 1
+        self._chunks[key] = chunk
+
+        while len(self._chunks) > self.max_resident:
+            old_key, old_chunk = self._chunks.popitem(last=False)
+            if old_key in self._dirty:
+                self._write_back(old_key, old_chunk)
+            self.evictions += 1
+        return chunk
+
+    def _write_back(self, key, chunk):
+        """ Write a changed chunk to the store. """
+        chunk_x, chunk_y = key
+        self._store[chunk_y, chunk_x] = chunk
+        self._written[chunk_y, chunk_x] = True
+        self._dirty.discard(key)
+
+    def _chunk_slices(self, x_location, y_location, w, h):
+        """ Iterate over the chunks overlapping a region, giving the chunk location and
+            the matching slices of the region and of the chunk. """
+        size = self.chunk_size
+        for chunk_y in range(y_location // size, (y_location + h - 1) // size + 1):
+            top = chunk_y * size
+            y0, y1 = max(y_location, top), min(y_location + h, top + size)
+            for chunk_x in range(x_location // size, (x_location + w - 1) // size + 1):
+                left = chunk_x * size
+                x0, x1 = max(x_location, left), min(x_location + w, left + size)
+                region_slices = (slice(y0 - y_location, y1 - y_location),
+                                 slice(x0 - x_location, x1 - x_location))
+                chunk_slices = (slice(y0 - top, y1 - top), slice(x0 - left, x1 - left))
+                yield (chunk_x, chunk_y), region_slices, chunk_slices
+
+    def read_region(self, x_location, y_location, w, h):
+        """ Return a copy of the tile ids of a region, which must lie within the map. """
+        tiles = np.empty((h, w), dtype=self.tile_dtype)
+        if w > 0 and h > 0:
+            for key, region_slices, chunk_slices in self._chunk_slices(x_location, y_location,
+                                                                       w, h):
+                tiles[region_slices] = self._chunk(*key)[chunk_slices]
+        return tiles
+
+    def write_region(self, x_location, y_location, tiles, mask=None):
+        """ Write an array of tile ids to a region within the map, only
+            where mask (of the same shape) is true if given. """
+        h, w = tiles.shape
+        if w == 0 or h == 0:
+            return
+        for key, region_slices, chunk_slices in self._chunk_slices(x_location, y_location, w, h):
+            chunk = self._chunk(*key)
+            if mask is None:
+                chunk[chunk_slices] = tiles[region_slices]
+            else:
+                part = mask[region_slices]
+                chunk[chunk_slices][part] = tiles[region_slices][part]
+            self._dirty.add(key)
+
+    def write_cells(self, xs, ys, tile):
+        """ Write a tile id to the cells at x and y locations (or arrays of them)
+            within the map, one chunk at a time. """
+        xs, ys = np.atleast_1d(xs), np.atleast_1d(ys)
+        size = self.chunk_size
+        keys = (ys // size) * self.chunks_x + xs // size
+        for key in np.unique(keys).tolist():
+            in_chunk = keys == key
+            chunk_key = (key % self.chunks_x, key // self.chunks_x)
+            self._chunk(*chunk_key)[ys[in_chunk] % size, xs[in_chunk] % size] = tile
+            self._dirty.add(chunk_key)
+
+    def prefetch(self, x_location, y_location, radius):
+        """ Load the chunks within radius cells of a location, most distant first, so
+            the chunks nearest the location are the last to be evicted. """
+        clipped = self._clip(x_location - radius, y_location - radius,
+                             2 * radius + 1, 2 * radius + 1)
+        if clipped is None:
+            return
+        x0, y0, x1, y1 = clipped
+        size = self.chunk_size
+        keys = [(chunk_x, chunk_y) for chunk_y in range(y0 // size, (y1 - 1) // size + 1)
+                for chunk_x in range(x0 // size, (x1 - 1) // size + 1)]
+        keys.sort(key=lambda k: -max(abs(k[0] * size + size // 2 - x_location),
+                                     abs(k[1] * size + size // 2 - y_location)))
+        for key in keys[-self.max_resident:]:
+            self._chunk(*key)
+
+    def flush(self):
+        """ Write all changed resident chunks to the store. """
+        for key in list(self._dirty):
+            self._write_back(key, self._chunks[key])
+        self._store.flush()
+        self._write_palette()
+
+    def close(self):
+        """ Flush the map and close the store, removing it if it is a temporary file. """
+        self.flush()
+        self._chunks.clear()
+        del self._store
+        if self._owns_file:
+            os.remove(self.path)
+
 
 class MazeSystem(Map):
     """ A Maze map of size width by height in terms of cells (not tiles). """
-    def __init__(self, width, height, *args):
+    ALGORITHMS = ["backtracker", "sidewinder"]
+
+    def __init__(self, width, height, *args, seed=None, algorithm: str = "backtracker"):
         """ Generate a map of a maze with a particular width and height in terms
             of rows and columns of the actual maze, since the map requires tiles
-            to provide the walkable area. """
+            to provide the walkable area. The same seed gives the same maze.
+            algorithm is "backtracker" (long winding corridors) or "sidewinder"
+            (generated with array operations, so much faster for huge mazes). """
+        if algorithm not in self.ALGORITHMS:
+            raise MapException(None, msg=f"Unknown maze algorithm: {algorithm}")
         super().__init__(width + 1 - (width % 2), height + 1 - (height % 2), *args)
-        self.map = self._gen_maze()
+        self.seed = seed
+        self.algorithm = algorithm
+        self.write_region(0, 0, self._gen_maze())
 
     def _gen_maze(self):
-        """ Generate maze using an iterative stack based approach. """
+        """ Generate the maze, returning its array of tile ids. """
+        wall, walkable = self.tile_id("WALL"), self.tile_id("WALKABLE")
+        if self.width < 3 or self.height < 3:
+            return np.full((self.height, self.width), wall, dtype=self.tile_dtype)
+        if self.algorithm == "sidewinder":
+            return self._gen_sidewinder(wall, walkable)
+        return self._gen_backtracker(wall, walkable)
+
+    def _gen_backtracker(self, wall, walkable):
+        """ Generate maze using an iterative stack based depth first search. """
+        width = self.width
+        size = width * self.height
+        rand = Random(self.seed).random
+
+        # tiles and visited are flat, row by row. Cells are the tiles at odd rows and
+        # columns, the cells around a cell are 2 tiles away. Every other tile counts
+        # as visited, as do the padding rows after the map (which negative indexes
+        # also reach), so the search needs no bounds checks.
+        tiles = bytearray([wall]) * size
+        visited = bytearray([1]) * (size + 2 * width)
+        cells = np.ones((self.height, width), dtype=np.uint8)
+        cells[1::2, 1::2] = 0
+        visited[:size] = cells.tobytes()
+        offsets = (2, -2, 2 * width, -2 * width)
+
+        # start with the top left cell
+        cell = width + 1
+        visited[cell] = 1
+        tiles[cell] = walkable
+        stack = [cell]
+        while stack:
+            cell = stack[-1]
+            options = [offset for offset in offsets if not visited[cell + offset]]
+            if not options:
+                stack.pop()
+                continue
+            offset = options[int(rand() * len(options))]
+            next_cell = cell + offset
+            visited[next_cell] = 1
+            # carve the wall between the cells as well as the next cell
+            tiles[cell + offset // 2] = walkable
+            tiles[next_cell] = walkable
+            stack.append(next_cell)
+
+        return (np.frombuffer(tiles, dtype=np.uint8).reshape(self.height, width)
+                .astype(self.tile_dtype))
+
+    def _gen_sidewinder(self, wall, walkable):
+        """ Generate maze using the sidewinder algorithm: each row is split into random
+            runs of cells joined east to west, and each run is joined north from one
+            random cell. The top row is a single run. """
         w, h = (self.width - 1) // 2, (self.height - 1) // 2
-
-        visited = [[False for _ in range(w)] for __ in range(h)]
-        cells = [(col, row) for col in range(w) for row in range(h)]
-
-        # push -> stack.append
-        # pop ->  stack.pop
-        stack = []
-
-        # start with (0,0)
-
-        first_cell = cells.pop(0)
-
-        visited[first_cell[0]][first_cell[1]] = True
-
-        stack.append(first_cell)
-
-        map_cells = [[1 if col % 2 == 0 or row % 2 == 0 else 0
-                      for col in range(self.width)] for row in range(self.height)]
-
-        def cell_to_map(x, y):
-            return 2 * x + 1, 2 * y + 1
-
-        def average_2_tuple(x1, y1, x2, y2):
-            return (x1 + x2) // 2, (y1 + y2) // 2
-
-        def north(x, y):
-            return (x - 1, y) if x > 0 else None
-
-        def east(x, y):
-            return (x, y + 1) if y < w - 1 else None
-
-        def south(x, y):
-            return (x + 1, y) if x < h - 1 else None
-
-        def west(x, y):
-            return (x, y - 1) if y > 0 else None
-
-        while len(stack) > 0:
-            current_cell = stack.pop()
-
-            neighbours = [north(*current_cell), east(*current_cell),
-                          south(*current_cell), west(*current_cell)]
-
-            neighbours = [n for n in neighbours if n is not None]
-            neighbours = [n for n in neighbours if not visited[n[0]][n[1]]]
-
-            if len(neighbours) > 0:
-                stack.append(current_cell)
-                shuffle(neighbours)
-                next_cell = neighbours[0]
-                map_wall = average_2_tuple(*cell_to_map(*current_cell), *cell_to_map(*next_cell))
-                map_cells[map_wall[0]][map_wall[1]] = 0
-                visited[next_cell[0]][next_cell[1]] = True
-                stack.append(next_cell)
-
-        return [
-            [["WALKABLE", "WALL"][x]
-             for x in line] for line in map_cells
-        ]
+        rng = np.random.default_rng(self.seed)
+        tiles = np.full((self.height, self.width), wall, dtype=self.tile_dtype)
+        tiles[1::2, 1::2] = walkable
+        tiles[1, 2:-1:2] = walkable
+        if h == 1:
+            return tiles
+
+        # join east unless at the east edge, or ending the run
+        east = rng.random((h - 1, w)) < 0.5
+        east[:, -1] = False
+        tiles[3::2, 2:-1:2][east[:, :-1]] = walkable
+
+        # runs start at the west edge or after a cell not joined east
+        starts = np.ones((h - 1, w), dtype=bool)
+        starts[:, 1:] = ~east[:, :-1]
+        starts = np.flatnonzero(starts)
+        lengths = np.diff(np.append(starts, (h - 1) * w))
+        chosen = starts + (rng.random(len(starts)) * lengths).astype(np.int64)
+        tiles[2 * (chosen // w) + 2, 2 * (chosen % w) + 1] = walkable
+        return tiles
@@ -1,6 +1,9 @@
 from unittest import TestCase
 # need MapSystem.map since suite outside inventory system folder
-from MapSystem.map import Map, MazeSystem, MapException
+from MapSystem.map import Map, MazeSystem, MapException, ChunkedMap
+import numpy as np
+import os
+import tempfile
 
 
 class MapTest(TestCase):
@@ -31,3 +34,226 @@ class MapTest(TestCase):
 
 
 
+
+    def test_map_tiles(self):
+        """ Test the tile array and the character key views over it. """
+        example_map = Map(6, 4, "WALL")
+        self.assertEqual(example_map.tiles.shape, (4, 6))
+        self.assertEqual(example_map.tiles.dtype, np.uint8)
+
+        example_map.map[1][2] = "WALKABLE"
+        example_map.draw_to_map("WALKABLE", 3, 1)
+        self.assertEqual(example_map.map[1][1:5], ["WALL", "WALKABLE", "WALKABLE", "WALL"])
+        self.assertEqual(list(example_map.map[0]), ["WALL"] * 6)
+        self.assertEqual(len(example_map.map), 4)
+        self.assertEqual(example_map.region_to_strings(2, 1, 2, 2),
+                         ["    ", example_map.MAP_CHARS["WALL"] * 2])
+        self.assertEqual(str(example_map).split("\n")[1],
+                         example_map.array_to_string(example_map.map[1]))
+        self.assertEqual(example_map.walkable_region(1, 0, 3, 2).tolist(),
+                         [[False, False, False], [False, True, True]])
+
+        example_map.map[2][1:4] = ["WALKABLE", "default", "WALKABLE"]
+        self.assertEqual(example_map.map[2][0:5], ["WALL", "WALKABLE", "default", "WALKABLE",
+                                                   "WALL"])
+        example_map.map[3] = ["WALKABLE"] * 5 + ["default"]
+        self.assertEqual(list(example_map.map[-1]), ["WALKABLE"] * 5 + ["default"])
+        with self.assertRaises(ValueError):
+            example_map.map[3][0:2] = ["WALL"]
+        with self.assertRaises(MapException):
+            example_map.map[3] = ["ObviouslyWrong"] * 6
+
+        example_map.map = [["WALL", "WALKABLE"], ["default", "WALL"]]
+        self.assertEqual(example_map.tiles.tolist(), [[2, 1], [0, 2]])
+
+        for i in range(300):
+            example_map.declare_map_char_block("BLOCK " + str(i), "{:02}".format(i % 100))
+        self.assertEqual(example_map.tiles.dtype, np.uint16)
+        example_map.map[0][0] = "BLOCK 299"
+        self.assertEqual(example_map.map[0][0], "BLOCK 299")
+        self.assertEqual(str(example_map).split("\n")[0], "99  ")
+
+        with self.assertRaises(MapException):
+            example_map.map[0][0] = "ObviouslyWrong"
+
+    def test_map_drawing(self):
+        """ Test the drawing primitives against drawing cell by cell. """
+        example_map = Map(12, 8, "WALKABLE")
+        example_map.fill_rect_to_map("WALL", -2, 5, 6, 10)
+        example_map.draw_rect_to_map("default", 6, 1, 5, 4)
+        expected = [[(x < 4 and y >= 5) or (x in [6, 10] and 1 <= y <= 4) or
+                     (y in [1, 4] and 6 <= x <= 10) for x in range(12)] for y in range(8)]
+        self.assertEqual((example_map.tiles != example_map.tile_id("WALKABLE")).tolist(),
+                         expected)
+
+        example_map = Map(10, 10, "WALKABLE")
+        example_map.draw_line_to_map("WALL", -3, -3, 12, 12)
+        example_map.draw_line_to_map("WALL", 0, 9, 9, 9)
+        self.assertEqual([example_map.map[i][i] for i in range(10)], ["WALL"] * 10)
+        self.assertEqual(list(example_map.map[9]), ["WALL"] * 10)
+        self.assertEqual(int((example_map.tiles == example_map.tile_id("WALL")).sum()), 19)
+
+        example_map = Map(9, 9, "WALKABLE")
+        example_map.draw_circle_to_map("WALL", 4, 4, 3)
+        self.assertEqual(example_map.map[4][4], "WALKABLE")
+        self.assertEqual((example_map.map[4][1], example_map.map[1][4]), ("WALL", "WALL"))
+        example_map.flood_fill_to_map("default", 4, 4)
+        self.assertEqual((example_map.map[4][3], example_map.map[0][0]), ("default", "WALKABLE"))
+        example_map.flood_fill_to_map("default", 0, 0)
+        self.assertTrue(example_map.walkable_region(0, 0, 9, 9).sum() ==
+                        (example_map.tiles != example_map.tile_id("WALL")).sum())
+        self.assertFalse(np.any(example_map.tiles == example_map.tile_id("WALKABLE")))
+
+        # a maze has a single walkable area, every walkable cell is filled
+        maze = MazeSystem(21, 11)
+        maze.flood_fill_to_map("default", 1, 1)
+        self.assertFalse(np.any(maze.tiles == maze.tile_id("WALKABLE")))
+
+        with self.assertRaises(MapException):
+            example_map.draw_to_map("ObviouslyWrong", 0, 0)
+
+    def test_map_sub_map(self):
+        """ Test drawing sub-maps with clipping and transparency. """
+        sub_map = Map(3, 2, "WALL")
+        sub_map.draw_to_map("WALKABLE", 1, 0)
+
+        example_map = Map(5, 4, "default")
+        example_map.draw_sub_map(sub_map, 3, 3)
+        example_map.draw_sub_map(sub_map, -1, 0, transparent="WALKABLE")
+        self.assertEqual(example_map.map[0][0:3], ["default", "WALL", "default"])
+        self.assertEqual(example_map.map[1][0:3], ["WALL", "WALL", "default"])
+        self.assertEqual(example_map.map[3][2:5], ["default", "WALL", "WALKABLE"])
+        self.assertEqual(example_map.map[2][2:5], ["default"] * 3)
+
+        sub_map.declare_map_char_block("PORTAL", "[]")
+        sub_map.draw_to_map("PORTAL", 0, 0)
+        with self.assertRaises(MapException):
+            example_map.draw_sub_map(sub_map, 0, 0)
+
+    def test_chunked_map(self):
+        """ Test that a chunked map draws like a map while holding few chunks in memory. """
+        example_map = Map(50, 37, "WALKABLE")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "world.chunks")
+            chunked = ChunkedMap(50, 37, "WALKABLE", chunk_size=8, max_resident=4, path=path)
+
+            maze = MazeSystem(9, 9)
+            for m in [example_map, chunked]:
+                m.fill_rect_to_map("WALL", 3, 5, 30, 20)
+                m.draw_circle_to_map("default", 25, 18, 9)
+                m.draw_line_to_map("WALKABLE", 0, 36, 49, 0)
+                m.flood_fill_to_map("default", 25, 18)
+                m.fill_rect_to_map("WALL", 36, 23, 14, 14)
+                m.draw_sub_map(maze, 38, 25, transparent="WALL")
+                m.map[36][49] = "WALL"
+
+            self.assertLessEqual(len(chunked._chunks), 4)
+            self.assertGreater(chunked.evictions, 0)
+            self.assertEqual(str(chunked), str(example_map))
+            self.assertEqual(chunked.map[36][40:50], example_map.map[36][40:50])
+            self.assertEqual(chunked.walkable_region(20, 10, 15, 15).tolist(),
+                             example_map.walkable_region(20, 10, 15, 15).tolist())
+
+            chunked.prefetch(48, 30, 4)
+            self.assertIn((5, 3), chunked._chunks)
+            chunked.close()
+
+            # the tiles were written back to the file
+            reopened = ChunkedMap(50, 37, chunk_size=8, max_resident=4, path=path)
+            self.assertEqual(str(reopened), str(example_map))
+            reopened.declare_map_char_block("PORTAL", "[]", walkable=True)
+            reopened.draw_to_map("PORTAL", 2, 2)
+            reopened.close()
+            self.assertTrue(os.path.exists(path))
+
+            # with the palette it was saved with
+            reopened = ChunkedMap(50, 37, chunk_size=8, path=path)
+            self.assertEqual(reopened.map[2][2], "PORTAL")
+            self.assertTrue(reopened.is_walkable("PORTAL"))
+            reopened.close()
+
+            # other files are never overwritten
+            size = os.path.getsize(path)
+            with self.assertRaises(MapException):
+                ChunkedMap(20, 20, chunk_size=8, path=path)
+            other_path = os.path.join(tmp_dir, "notes.txt")
+            with open(other_path, 'w') as fp:
+                fp.write("not a chunk store")
+            with self.assertRaises(MapException):
+                ChunkedMap(50, 37, chunk_size=8, path=other_path)
+            self.assertEqual(os.path.getsize(path), size)
+            with open(other_path) as fp:
+                self.assertEqual(fp.read(), "not a chunk store")
+
+        chunked = ChunkedMap(10, 10, chunk_size=4)
+        with self.assertRaises(MapException):
+            chunked.map = [["WALL"]]
+
+        # the palette is left unchanged when the store cannot hold another key
+        for i in range(253):
+            chunked.declare_map_char_block("BLOCK " + str(i), "{:02}".format(i % 100))
+        with self.assertRaises(MapException):
+            chunked.declare_map_char_block("ONE TOO MANY", "!!")
+        self.assertEqual(len(chunked.palette), 256)
+        self.assertNotIn("ONE TOO MANY", chunked.MAP_CHARS)
+        chunked.close()
+        self.assertFalse(os.path.exists(chunked.path))
+
+    def test_map_file(self):
+        """ Test saving maps and opening them memory-mapped. """
+        maze = MazeSystem(21, 15)
+        maze.declare_map_char_block("PORTAL", "[]", walkable=True)
+        maze.draw_to_map("PORTAL", 1, 1)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "maze.map")
+            maze.save(path, rows_per_write=4)
+
+            opened = Map.open(path)
+            self.assertTrue(isinstance(opened.tiles, np.memmap))
+            self.assertEqual(opened.dims, maze.dims)
+            self.assertEqual(str(opened), str(maze))
+            self.assertTrue(opened.is_walkable(opened.map[1][1]))
+            with self.assertRaises(ValueError):
+                opened.draw_to_map("WALL", 1, 1)
+
+            writable = Map.open(path, mode='r+')
+            writable.fill_rect_to_map("WALL", 0, 0, 3, 3)
+            writable.tiles.flush()
+            del writable
+            self.assertEqual(Map.open(path).map[1][1], "WALL")
+
+            # chunked maps save the same format
+            chunked = ChunkedMap(maze.width, maze.height, chunk_size=4)
+            chunked.declare_map_char_block("PORTAL", "[]", walkable=True)
+            chunked.draw_sub_map(maze, 0, 0)
+            chunked.save(path)
+            chunked.close()
+            self.assertEqual(str(Map.open(path)), str(maze))
+
+            with open(path, 'wb') as fp:
+                fp.write(b"not a map")
+            with self.assertRaises(MapException):
+                Map.open(path)
+
+    def test_maze(self):
+        """ Test mazes are reproducible, connected and without loops for any size. """
+        for algorithm in MazeSystem.ALGORITHMS:
+            for width, height in [(41, 41), (31, 9), (7, 25), (3, 3)]:
+                maze = MazeSystem(width, height, seed=5, algorithm=algorithm)
+                self.assertEqual(maze.tiles.shape, (height, width))
+                self.assertEqual(str(maze), str(MazeSystem(width, height, seed=5,
+                                                           algorithm=algorithm)))
+
+                # a perfect maze is a tree: every cell is walkable and joined to
+                # one less passage than there are cells, all reachable from the start
+                cells = (width // 2) * (height // 2)
+                walkable = maze.tiles == maze.tile_id("WALKABLE")
+                self.assertTrue(walkable[1::2, 1::2].all())
+                self.assertEqual(int(walkable.sum()), 2 * cells - 1)
+                maze.flood_fill_to_map("default", 1, 1)
+                self.assertFalse(np.any(maze.tiles == maze.tile_id("WALKABLE")))
+
+        self.assertNotEqual(str(MazeSystem(41, 41, seed=1)), str(MazeSystem(41, 41, seed=2)))
+        with self.assertRaises(MapException):
+            MazeSystem(9, 9, algorithm="ObviouslyWrong")
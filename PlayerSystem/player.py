@@ -1,5 +1,6 @@
 from __future__ import annotations
 from InventorySystem.inventory import Inventory, Item, InventoryException, Wallet, CurrencySystem
+import GameSystem.json_pickler as jp
 import numpy as np
 import math
 from ansiwrap import *
@@ -14,7 +15,7 @@ class PlayerException(Exception):
         self.msg = msg
 
 
-class PointSystem:
+class PointSystem(jp.JSONEncodable):
     """ Represents a generalized point system.
         Can be used for experience (ExpSys)
         or health points (HealthSys)
@@ -26,6 +27,8 @@ class PointSystem:
         self.level_coefficients = level_coefficients
         if level_coefficients is None:
             self.level_coefficients = np.array([1.])
+        # encoding at the last checkpoint, None if never checkpointed.
+        self._clean = None
 
     def limit_for_level(self, level: int, cumulative: bool = False):
         """ Map level to a value which will specify the limit for the given level.
@@ -45,6 +48,23 @@ class PointSystem:
         """ Set the point systems maximum point limit according to the level. """
         pass
 
+    def json_is_dirty(self) -> bool:
+        """ Whether the points changed since the last checkpoint. """
+        return self._clean != self.json_encode()
+
+    def json_mark_clean(self):
+        """ Mark the current points as saved. """
+        self._clean = self.json_encode()
+
+    def json_encode_delta(self):
+        """ Point systems are small, so the delta is the whole encoding. """
+        return self.json_encode()
+
+    def json_apply_delta(self, delta: dict):
+        """ Apply a delta from json_encode_delta, in place. """
+        self.__dict__.update(self.json_decode(delta).__dict__)
+        return self
+
 
 class ExpSys(PointSystem):
     """ An Experience Point System for gaining experience to level up a character. """
@@ -87,6 +107,21 @@ class ExpSys(PointSystem):
 
         return self.level
 
+    def json_encode(self) -> dict:
+        """ Encode experience system as JSON dictionary. """
+        return {
+            "level": self.level,
+            "exp": self.exp,
+            "level_coefficients": self.level_coefficients.tolist(),
+        }
+
+    @classmethod
+    def json_decode(cls, obj_json):
+        """ Turn dictionary back into an experience system. """
+        return ExpSys(level=obj_json["level"], exp=obj_json["exp"],
+                      level_coefficients=np.array(obj_json["level_coefficients"],
+                                                  dtype=np.float64))
+
     def display_bar(self, bar_length: int = 20):
         """ Display experience points as a bar being filled. """
         if self.exp is None or self.max_exp is None:
@@ -135,6 +170,25 @@ class HealthSys(PointSystem):
         if self.hp < 0:
             self.hp = 0
 
+    def json_encode(self) -> dict:
+        """ Encode health system as JSON dictionary. """
+        return {
+            "level": self.level,
+            "hp": self.hp,
+            "max_hp": self.max_hp,
+            "level_coefficients": self.level_coefficients.tolist(),
+        }
+
+    @classmethod
+    def json_decode(cls, obj_json):
+        """ Turn dictionary back into a health system. """
+        health_sys = HealthSys(level=obj_json["level"],
+                               level_coefficients=np.array(obj_json["level_coefficients"],
+                                                           dtype=np.float64))
+        health_sys.hp = obj_json["hp"]
+        health_sys.max_hp = obj_json["max_hp"]
+        return health_sys
+
     def display_bar(self, bar_length: int = 20):
         """ Display experience points as a bar being filled. """
         if self.hp is None or self.max_hp is None:
@@ -144,7 +198,7 @@ class HealthSys(PointSystem):
                " " * (bar_length - math.ceil(bar_length * self.hp / self.max_hp)) + "|"
 
 
-class PlayerSystem:
+class PlayerSystem(jp.JSONEncodable):
     """ Represents a playable character
         A lot of inspiration came from
         <a href="http://howtomakeanrpg.com/a/how-to-make-an-rpg-levels.html">Here</a>.
@@ -188,6 +242,10 @@ class PlayerSystem:
         if init_wallet is not None:
             self.wallet = init_wallet
 
+        # point systems and wallet at the last checkpoint, None if never checkpointed.
+        # Replacing any of them means it is saved in full.
+        self._clean_parts = None
+
     def __str__(self):
         """ Represent player using the different point systems associated with the player. """
         level = None
@@ -261,3 +319,89 @@ class PlayerSystem:
             the player is getting paid for the item, if payment is None, then the
             item is being dropped. """
         pass
+
+    def json_encode(self) -> dict:
+        """ Encode player as JSON dictionary. """
+        return {
+            "point_systems": self.point_systems,
+            "inventory": self.inventory,
+            "wallet": self.wallet,
+        }
+
+    @classmethod
+    def json_decode(cls, obj_json):
+        """ Turn dictionary back into a player. Point systems are kept at the same level,
+            which is passed on so that they keep their points. """
+        point_systems = obj_json["point_systems"]
+        level = point_systems[0].level if len(point_systems) > 0 else 1
+        return PlayerSystem(level=level, point_systems=point_systems,
+                            inventory=obj_json["inventory"], init_wallet=obj_json["wallet"])
+
+    def _json_parts(self):
+        """ Point systems and wallet making up the player, compared by identity against
+            the last checkpoint. The inventory is not, since adding to it replaces it with
+            a copy that still tracks the changes since the checkpoint. """
+        return tuple(self.point_systems), self.wallet
+
+    def json_is_dirty(self) -> bool:
+        """ Whether the player changed since the last checkpoint. """
+        if self._clean_parts is None:
+            return True
+        point_systems, wallet = self._clean_parts
+        return (len(point_systems) != len(self.point_systems) or
+                any(a is not b for a, b in zip(point_systems, self.point_systems)) or
+                wallet is not self.wallet or
+                any(ps.json_is_dirty() for ps in self.point_systems) or
+                self.inventory.json_is_dirty() or self.wallet.json_is_dirty())
+
+    def json_mark_clean(self):
+        """ Mark the player's current state as saved. """
+        for ps in self.point_systems:
+            ps.json_mark_clean()
+        self.inventory.json_mark_clean()
+        self.wallet.json_mark_clean()
+        self._clean_parts = self._json_parts()
+
+    def json_encode_delta(self):
+        """ Encode the parts of the player changed since the last checkpoint,
+            or the player itself if it was never checkpointed. """
+        if self._clean_parts is None:
+            return self
+        point_systems, wallet = self._clean_parts
+
+        delta = {}
+        if (len(point_systems) != len(self.point_systems) or
+                any(a is not b for a, b in zip(point_systems, self.point_systems))):
+            delta["point_systems"] = self.point_systems
+        elif any(ps.json_is_dirty() for ps in self.point_systems):
+            delta["point_systems"] = [[i, ps.json_encode_delta()]
+                                      for i, ps in enumerate(self.point_systems)
+                                      if ps.json_is_dirty()]
+
+        # a new inventory (never checkpointed) encodes itself in full.
+        if self.inventory.json_is_dirty():
+            delta["inventory"] = self.inventory.json_encode_delta()
+
+        if wallet is not self.wallet:
+            delta["wallet"] = self.wallet
+        elif self.wallet.json_is_dirty():
+            delta["wallet"] = self.wallet.json_encode_delta()
+        return delta
+
+    def json_apply_delta(self, delta: dict):
+        """ Apply a delta from json_encode_delta. """
+        if "point_systems" in delta:
+            if all(isinstance(ps, PointSystem) for ps in delta["point_systems"]):
+                # the list of point systems was replaced
+                self.point_systems = delta["point_systems"]
+            else:
+                for i, ps_delta in delta["point_systems"]:
+                    self.point_systems[i] = jp.apply_delta(self.point_systems[i], ps_delta)
+        experience_systems = [p_sys for p_sys in self.point_systems if type(p_sys) is ExpSys]
+        self.exp_sys = experience_systems[0] if len(experience_systems) >= 1 else None
+
+        if "inventory" in delta:
+            self.inventory = jp.apply_delta(self.inventory, delta["inventory"])
+        if "wallet" in delta:
+            self.wallet = jp.apply_delta(self.wallet, delta["wallet"])
+        return self
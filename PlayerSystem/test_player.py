@@ -1,7 +1,78 @@
 from unittest import TestCase
-# need MapSystem.map since suite outside inventory system folder
+# need PlayerSystem.player since suite outside player system folder
+from PlayerSystem.player import PlayerSystem, ExpSys, HealthSys
+from InventorySystem.inventory import Item, Wallet
+import GameSystem.json_pickler as jp
+import os
+import tempfile
 
 
 class PlayerTest(TestCase):
     """ PlayerSystem module test cases. """
-    pass
+    def test_player_delta_log(self):
+        """ Test that a player saved as a snapshot plus deltas loads equal to the player. """
+        player = PlayerSystem(level=2, point_systems=[ExpSys(), HealthSys()], init_amount=30)
+        player.inventory += Item("Apple", quantity=3)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "player.save")
+            log = jp.DeltaLog(path)
+            log.checkpoint(player)
+            self.assertFalse(player.json_is_dirty())
+
+            player._gain_points(5, ExpSys)
+            player.inventory += Item("Pear", quantity=2)
+            player.wallet.add_currency("Gold", 4)
+            self.assertTrue(player.json_is_dirty())
+            log.checkpoint(player)
+
+            # nothing changed, nothing written
+            size = os.path.getsize(path)
+            log.checkpoint(player)
+            self.assertEqual(os.path.getsize(path), size)
+
+            player.wallet = Wallet(amount=7)
+            player.inventory -= Item("Apple", quantity=3)
+            log.checkpoint(player)
+            self.assertEqual(log.num_deltas, 2)
+
+            loaded = jp.DeltaLog(path).load()
+            self.assertEqual(loaded.inventory, player.inventory)
+            self.assertEqual(loaded.wallet, player.wallet)
+            self.assertEqual([ps.json_encode() for ps in loaded.point_systems],
+                             [ps.json_encode() for ps in player.point_systems])
+            self.assertTrue(loaded.exp_sys is loaded.point_systems[0])
+            self.assertFalse(loaded.json_is_dirty())
+
+            log.compact()
+            self.assertEqual(log.num_deltas, 0)
+            self.assertEqual(jp.DeltaLog(path).load().inventory, player.inventory)
+            self.assertEqual(os.listdir(tmp_dir), ["player.save"])
+
+            # adding to a large inventory only saves the changed stack
+            player.inventory += [Item("Item " + str(i), quantity=2) for i in range(300)]
+            log.checkpoint(player)
+            size = os.path.getsize(path)
+            player.inventory += Item("Item 7")
+            log.checkpoint(player)
+            self.assertLess(os.path.getsize(path) - size, size // 20)
+            self.assertEqual(jp.DeltaLog(path).load().inventory, player.inventory)
+
+    def test_player_stream(self):
+        """ Test that a player's inventory is streamed one stack per line. """
+        player = PlayerSystem(level=3, point_systems=[ExpSys(), HealthSys()], init_amount=12)
+        player.inventory += [Item("Item " + str(i), quantity=2) for i in range(300)]
+
+        with tempfile.TemporaryFile('w+') as fp:
+            jp.dump(player, fp)
+            fp.seek(0)
+            lines = fp.readlines()
+            self.assertGreater(len(lines), 300)
+            self.assertTrue(all(len(line) < 1000 for line in lines))
+
+            fp.seek(0)
+            loaded = jp.load(fp)
+            self.assertEqual(loaded.inventory, player.inventory)
+            self.assertEqual(loaded.wallet, player.wallet)
+            self.assertEqual([ps.json_encode() for ps in loaded.point_systems],
+                             [ps.json_encode() for ps in player.point_systems])
@@ -0,0 +1,122 @@
+# tests/benchmark.py
+import sys
+import time
+import json
+from pathlib import Path
+
+length_of_dash = 84
+
+
+def timed(function, *args, repeat: int = 3):
+    """ Return the result of function(*args) and the best time of several runs in seconds. """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def print_table(title: str, header: list, rows: list):
+    """ Print benchmark results as a table of columns. """
+    print("-" * length_of_dash)
+    print(title)
+    print("-" * length_of_dash)
+    print("".join(['{:>16}'.format(h) for h in header]))
+    for row in rows:
+        print("".join(['{:>16}'.format(f"{r:.4f}" if type(r) == float else str(r))
+                       for r in row]))
+
+
+def bench_serialization(num_items: int = 5000):
+    """ Compare size and encode / decode time of the JSON and binary picklers
+        on an inventory of num_items stacks. """
+    import GameSystem.json_pickler as jp
+    import GameSystem.binary_pickler as bp
+    from InventorySystem.inventory import (Inventory, InventorySystem, ItemFilter,
+                                           ItemCategory, Item)
+
+    categories = [ItemCategory("Category " + str(i)) for i in range(8)]
+    filters = ItemFilter.generate_filters([[c] for c in categories[:4]])
+    inv = Inventory(pages=[InventorySystem(item_filter=f) for f in filters])
+    inv += [Item("Item " + str(i), quantity=i % 50 + 1, category=categories[i % 8],
+                 price=i % 200, unit_weight=i % 7 + 1) for i in range(num_items)]
+
+    json_text, json_encode = timed(lambda: json.dumps(inv, cls=jp.JSONEncoder))
+    _, json_decode = timed(lambda: json.loads(json_text, cls=jp.JSONDecoder))
+    binary, binary_encode = timed(bp.dumps, inv)
+    _, binary_decode = timed(bp.loads, binary)
+
+    rows = [
+        ["json", len(json_text.encode("utf-8")), json_encode, json_decode],
+        ["binary", len(binary), binary_encode, binary_decode],
+    ]
+    print_table(f"Serialization of {num_items} item stacks",
+                ["format", "bytes", "encode (s)", "decode (s)"], rows)
+    return rows
+
+
+def bench_spawning(num_merchants: int = 10000):
+    """ Compare building merchant inventories item by item with spawning them
+        from an InventoryTemplate. """
+    from InventorySystem.inventory import (Inventory, InventorySystem, InventoryTemplate,
+                                           ItemFilter, ItemCategory, Item)
+
+    categories = [ItemCategory(name) for name in ["Weapons", "Armour", "Food"]]
+    filters = ItemFilter.generate_filters([[c] for c in categories] + [[None]])
+    stock = [Item("Item " + str(i), quantity=i % 5 + 1, category=categories[i % 3],
+                  price=i * 3 + 1, unit_weight=i % 4 + 1) for i in range(30)]
+
+    def build(n):
+        merchants = []
+        for _ in range(n):
+            inv = Inventory(pages=[InventorySystem(item_filter=f, max_slots=40) for f in filters])
+            inv += stock
+            merchants.append(inv)
+        return merchants
+
+    template = InventoryTemplate(
+        pages=[InventorySystem(item_filter=f, max_slots=40) for f in filters], items=stock)
+
+    num_built = max(1, num_merchants // 10)
+    _, build_time = timed(build, num_built, repeat=1)
+    merchants, spawn_time = timed(template.spawn_many, num_merchants, repeat=1)
+    assert merchants[-1] == build(1)[0]
+
+    rows = [
+        ["item by item", num_built, build_time, f"{build_time / num_built * 1e6:.1f}"],
+        ["template", num_merchants, spawn_time, f"{spawn_time / num_merchants * 1e6:.1f}"],
+    ]
+    print_table(f"Spawning merchant inventories ({len(stock)} stacks each)",
+                ["method", "merchants", "total (s)", "each (us)"], rows)
+    return rows
+
+
+def bench_maze(sizes=(250, 1000, 4000)):
+    """ Time maze generation for each algorithm, in cells generated per second. """
+    from MapSystem.map import MazeSystem
+
+    rows = []
+    for algorithm in MazeSystem.ALGORITHMS:
+        for size in sizes:
+            _, elapsed = timed(lambda: MazeSystem(size, size, seed=0, algorithm=algorithm),
+                               repeat=1)
+            cells = (size // 2) ** 2
+            rows.append([algorithm, f"{size}x{size}", elapsed, f"{cells / elapsed:,.0f}"])
+    print_table("Maze generation", ["algorithm", "tiles", "total (s)", "cells / s"], rows)
+    return rows
+
+
+if __name__ == "__main__":
+    # Expecting to be run in TestRunner package
+    source_path = Path(__file__).resolve()
+    source_dir = str(source_path.parent.parent)
+
+    if source_dir not in sys.path:
+        sys.path.append(source_dir)
+
+    bench_serialization()
+    bench_spawning()
+    bench_maze()